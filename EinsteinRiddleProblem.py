@@ -1,7 +1,10 @@
 import copy
 import time
 
-from csp import Constraint, CSP
+import numpy as np
+
+from csp import AllDifferent, Constraint, CSP
+from tables import compile_tables
 from typing import Dict, List, Optional
 import pprint
 
@@ -32,44 +35,47 @@ def results(solution, problem):
 
 
 class Variable:
+    __slots__ = ("name", "category", "_hash")
+
     def __init__(self, category, name):
         self.name = name
         self.category = category
+        self._hash = hash((category, name))
 
     def __eq__(self, other):
-        return self.name == other.name and self.category == other.category
+        return self is other or (self.name == other.name and self.category == other.category)
 
     def __hash__(self):
-        return hash(self.name) ^ hash(self.category)
+        return self._hash
 
     def __str__(self):
         return "Var: {}".format(self.name)
 
 
 class EinsteinUniqueConstraint(Constraint[Variable, int]):
+    # Reads the other variables of the category from the whole assignment
+    scoped = False
+
     def __init__(self, variable: Variable):
         super().__init__([variable])
         self.variable: Variable = variable
 
     def satisfied(self, assignment: Dict[Variable, int]) -> bool:
+        # Other variables of the category are not in the scope, prefer EinsteinUniqueConstraintNew
+        if self.variable not in assignment:
+            return True
+        own_value = assignment[self.variable]
         for key, value in assignment.items():
-            if key.name != self.variable.name and key.category == self.variable.category and value == assignment[self.variable]:
+            if value == own_value and key.category == self.variable.category and key.name != self.variable.name:
                 return False
         return True
 
 
-class EinsteinUniqueConstraintNew(Constraint[Variable, int]):
+class EinsteinUniqueConstraintNew(AllDifferent[Variable, int]):
     def __init__(self, variabless: List[Variable]):
         super().__init__(variabless)
         self.variables: List[Variable] = variabless
 
-    def satisfied(self, assignment: Dict[Variable, int]) -> bool:
-        values = []
-        for key, value in assignment.items():
-            if key.name in [var.name for var in self.variables]:
-                values.append(value)
-        return len(values) == len(set(values))
-
 class EinsteinNeighbourConstraint(Constraint[Variable, int]):
     def __init__(self, var1: Variable, var2: Variable, where: str):
         super().__init__([var1, var2])
@@ -86,6 +92,15 @@ class EinsteinNeighbourConstraint(Constraint[Variable, int]):
         elif self.where == "NEXT":
             return abs(assignment[self.var1] - assignment[self.var2]) == 1
 
+    def table(self, x_values: List[int], y_values: List[int]):
+        x = np.array(x_values)[:, None]
+        y = np.array(y_values)[None, :]
+        if self.where == "LEFT":
+            return x + 1 == y
+        elif self.where == "NEXT":
+            return abs(x - y) == 1
+        return np.zeros((len(x_values), len(y_values)), dtype=bool)
+
 
 class EinsteinSameHouseConstraint(Constraint[Variable, int]):
     def __init__(self, var1: Variable, var2: Variable):
@@ -99,6 +114,9 @@ class EinsteinSameHouseConstraint(Constraint[Variable, int]):
             return True
         return assignment[self.var1] == assignment[self.var2]
 
+    def table(self, x_values: List[int], y_values: List[int]):
+        return np.array(x_values)[:, None] == np.array(y_values)[None, :]
+
 
 class EinsteinHouseNumberConstraint(Constraint[Variable, int]):
     def __init__(self, var1: Variable, number: int):
@@ -159,6 +177,7 @@ if __name__ == "__main__":
             if val.category == key:
                 group.append(val)
         csp.add_constraint(EinsteinUniqueConstraintNew(group))
+    compile_tables(csp)
 
     # for name, val in var_dict.items():
     #     csp.add_constraint(EinsteinUniqueConstraint(val))
@@ -1,7 +1,6 @@
 import math
 import numpy as np
-from shapely.geometry import LineString
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Set, Tuple
 from matplotlib import collections  as mc, ticker
 import pylab as plt
 import random
@@ -21,9 +20,13 @@ def flatten(l_of_ls):
 
 
 class Point:
+    # Points are dict keys on every hot path of the search, so the hash is computed once
+    __slots__ = ("x", "y", "_hash")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
+        self._hash = hash((x, y))
 
     def coords(self):
         return self.x, self.y
@@ -32,10 +35,193 @@ class Point:
         return "({},{})".format(self.x, self.y)
 
     def __eq__(self, other):
-        return self.x == other.x and self.y == other.y
+        return self is other or (self.x == other.x and self.y == other.y)
 
     def __hash__(self):
-        return hash(self.x) ^ hash(self.y)
+        return self._hash
+
+
+def orientation(a, b, c):
+    # Sign of the cross product (b - a) x (c - a)
+    value = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (value > 0) - (value < 0)
+
+
+def segments_intersect(a, b, c, d):
+    # Closed segments ab and cd have a common point (touching and overlapping included)
+    o1 = orientation(a, b, c)
+    o2 = orientation(a, b, d)
+    o3 = orientation(c, d, a)
+    o4 = orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+
+    def on_segment(p, q, r):
+        # q collinear with pr lies between p and r
+        return min(p[0], r[0]) <= q[0] <= max(p[0], r[0]) and min(p[1], r[1]) <= q[1] <= max(p[1], r[1])
+
+    return (o1 == 0 and on_segment(a, c, b)) or (o2 == 0 and on_segment(a, d, b)) or \
+        (o3 == 0 and on_segment(c, a, d)) or (o4 == 0 and on_segment(c, b, d))
+
+
+def orientations(ax, ay, bx, by, cx, cy):
+    # Sign of the cross product (b - a) x (c - a), for arrays of coordinates
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def between(px, py, qx, qy, rx, ry):
+    # q collinear with pr lies between p and r
+    return (np.minimum(px, rx) <= qx) & (qx <= np.maximum(px, rx)) & \
+        (np.minimum(py, ry) <= qy) & (qy <= np.maximum(py, ry))
+
+
+def segments_cross(a, b, c, d):
+    # Closed segments ab and cd have a common point (touching and overlapping included)
+    # and no common end point. Arrays of points (last axis x, y), broadcast over leading axes.
+    ax, ay, bx, by = a[..., 0], a[..., 1], b[..., 0], b[..., 1]
+    cx, cy, dx, dy = c[..., 0], c[..., 1], d[..., 0], d[..., 1]
+    o1 = orientations(ax, ay, bx, by, cx, cy)
+    o2 = orientations(ax, ay, bx, by, dx, dy)
+    o3 = orientations(cx, cy, dx, dy, ax, ay)
+    o4 = orientations(cx, cy, dx, dy, bx, by)
+    shared = ((ax == cx) & (ay == cy)) | ((ax == dx) & (ay == dy)) | ((bx == cx) & (by == cy)) | \
+        ((bx == dx) & (by == dy))
+    cross = (o1 != o2) & (o3 != o4)
+    # Touching and overlapping, only possible if some orientation is zero
+    collinear = (o1 * o2 * o3 * o4 == 0) & ~shared
+    if collinear.any():
+        cross |= (o1 == 0) & between(ax, ay, cx, cy, bx, by)
+        cross |= (o2 == 0) & between(ax, ay, dx, dy, bx, by)
+        cross |= (o3 == 0) & between(cx, cy, ax, ay, dx, dy)
+        cross |= (o4 == 0) & between(cx, cy, bx, by, dx, dy)
+    return cross & ~shared
+
+
+class PointIndex:
+    # Uniform grid of points, cells are about the mean distance between points
+    def __init__(self, points: List[Point], width, height):
+        self.points = points
+        self.coords = np.array([point.coords() for point in points], dtype=float).reshape(-1, 2)
+        self.size = max(1.0, math.sqrt(max(width, 1) * max(height, 1) / max(len(points), 1)))
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, point in enumerate(points):
+            self.cells.setdefault(self.cell(point.x, point.y), []).append(i)
+        self.bounds = (min((c[0] for c in self.cells), default=0), min((c[1] for c in self.cells), default=0),
+                       max((c[0] for c in self.cells), default=0), max((c[1] for c in self.cells), default=0))
+
+    def cell(self, x, y):
+        return int(x // self.size), int(y // self.size)
+
+    def ring(self, cx, cy, k):
+        # Occupied area of cells at distance k from (cx, cy)
+        x0, y0, x1, y1 = self.bounds
+        if k == 0:
+            yield cx, cy
+            return
+        for x in range(max(cx - k, x0), min(cx + k, x1) + 1):
+            if cy - k >= y0:
+                yield x, cy - k
+            if cy + k <= y1:
+                yield x, cy + k
+        for y in range(max(cy - k + 1, y0), min(cy + k - 1, y1) + 1):
+            if cx - k >= x0:
+                yield cx - k, y
+            if cx + k <= x1:
+                yield cx + k, y
+
+    def nearest(self, i, rings=3, chunk=64) -> Iterator[np.ndarray]:
+        # Arrays of indexes of other points by increasing distance from points[i], equal distances
+        # in order of points. After scanning ring k of cells every point closer than k cells is known,
+        # points further than the first rings are sorted all at once.
+        point = self.points[i]
+        cx, cy = self.cell(point.x, point.y)
+        found = np.zeros(0, dtype=int)
+        unseen = np.ones(len(self.points), dtype=bool)
+        unseen[i] = False
+        for k in range(rings):
+            ring = [j for cell in self.ring(cx, cy, k) for j in self.cells.get(cell, ()) if j != i]
+            unseen[ring] = False
+            found = np.concatenate([found, ring]).astype(int)
+            distances = ((self.coords[found] - self.coords[i]) ** 2).sum(axis=1)
+            near = distances < (k * self.size) ** 2
+            if near.any():
+                yield found[near][np.lexsort((found[near], distances[near]))]
+                found = found[~near]
+        rest = np.concatenate([found, np.flatnonzero(unseen)])
+        distances = ((self.coords[rest] - self.coords[i]) ** 2).sum(axis=1)
+        rest = rest[np.lexsort((rest, distances))]
+        for start in range(0, len(rest), chunk):
+            yield rest[start:start + chunk]
+
+
+class SegmentIndex:
+    # Segments registered in every cell of a uniform grid they pass through.
+    # Coordinates are kept in a growable array, rows x1, y1, x2, y2, for segments_cross.
+    def __init__(self, size):
+        self.size = size
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        self.segments: List[Tuple[Point, Point]] = []
+        self.coords = np.zeros((16, 4))
+
+    def __len__(self):
+        return len(self.segments)
+
+    def walk(self, a: Point, b: Point) -> Iterator[Tuple[int, int]]:
+        # Cells covered by ab from a to b, pieces of half a cell cover at most 2x2 cells each
+        steps = max(1, math.ceil(count_distance(a, b) * 2 / self.size))
+        margin = self.size * 1e-9
+        cells = set()
+        for k in range(steps):
+            x0 = a.x + (b.x - a.x) * k / steps
+            y0 = a.y + (b.y - a.y) * k / steps
+            x1 = a.x + (b.x - a.x) * (k + 1) / steps
+            y1 = a.y + (b.y - a.y) * (k + 1) / steps
+            for cx in range(int((min(x0, x1) - margin) // self.size), int((max(x0, x1) + margin) // self.size) + 1):
+                for cy in range(int((min(y0, y1) - margin) // self.size),
+                                int((max(y0, y1) + margin) // self.size) + 1):
+                    if (cx, cy) not in cells:
+                        cells.add((cx, cy))
+                        yield cx, cy
+
+    def add(self, a: Point, b: Point):
+        if len(self.segments) == len(self.coords):
+            self.coords = np.concatenate([self.coords, np.zeros_like(self.coords)])
+        self.coords[len(self.segments)] = a.x, a.y, b.x, b.y
+        self.segments.append((a, b))
+        for cell in self.walk(a, b):
+            self.cells.setdefault(cell, []).append(len(self.segments) - 1)
+
+    def crossings(self, a: Point, b: Point, indexes=None) -> np.ndarray:
+        # Which segments (all or indexes) cross ab, in one call
+        coords = self.coords[:len(self.segments)] if indexes is None else self.coords[indexes]
+        return segments_cross(np.array(a.coords(), dtype=float), np.array(b.coords(), dtype=float),
+                              coords[:, :2], coords[:, 2:])
+
+    def blocked(self, a: Point, targets: np.ndarray, indexes) -> np.ndarray:
+        # Which segments from a to every row of targets cross any of segments indexes
+        coords = self.coords[indexes]
+        cross = segments_cross(np.array(a.coords(), dtype=float), targets[:, None, :],
+                               coords[None, :, :2], coords[None, :, 2:])
+        return cross.any(axis=1)
+
+    def intersects(self, a: Point, b: Point) -> bool:
+        return self.crossing(a, b) is not None
+
+    def crossing(self, a: Point, b: Point) -> Optional[int]:
+        # Segment without common end point crossing ab, nearest cells to a first.
+        # Cells hold few segments, so they are tested one by one instead of in a batch.
+        checked: Set[int] = set()
+        for cell in self.walk(a, b):
+            for i in self.cells.get(cell, ()):
+                if i in checked:
+                    continue
+                checked.add(i)
+                c, d = self.segments[i]
+                if c in (a, b) or d in (a, b):
+                    continue
+                if segments_intersect(a.coords(), b.coords(), c.coords(), d.coords()):
+                    return i
+        return None
 
 
 class Grid:
@@ -44,6 +230,8 @@ class Grid:
         self.y = y
         self.points: List[Point] = []
         self.connections: (Point, Point) = []  # (p1, p2)
+        # Index of connections, built by generate_connections
+        self.segments: Optional[SegmentIndex] = None
         # 100
         random.seed(102)
 
@@ -58,23 +246,74 @@ class Grid:
                     break
 
     def generate_connections(self):
-        distances: Dict[Point, List[(Point, float)]] = {}
-        for point in self.points:
-            distances[point] = []
-            for other_point in self.points:
-                if other_point != point:
-                    distances[point].append((other_point, count_distance(point, other_point)))
-            distances[point].sort(key=lambda p: p[1], reverse=False)
-
-        while len(flatten([self.possible_connections(point) for point in self.points])) != 0:
-            point = random.choice(list(distances.keys()))
-            options = self.possible_connections(point)
-            if len(options) == 0:
+        # Random point is connected to its nearest point without crossing an existing connection,
+        # until no point has any. Candidates of a point never come back, so every point keeps
+        # a pointer into its points by distance and only moves it forward.
+        index = PointIndex(self.points, self.x, self.y)
+        self.segments = SegmentIndex(index.size)
+        positions = {point: i for i, point in enumerate(self.points)}
+        connected: List[Set[int]] = [set() for _ in self.points]
+        for connection in self.connections:
+            self.segments.add(connection[0], connection[1])
+            connected[positions[connection[0]]].add(positions[connection[1]])
+            connected[positions[connection[1]]].add(positions[connection[0]])
+
+        nearest = [index.nearest(i) for i in range(len(self.points))]
+        coords = index.coords
+        # Next nearest points of the point, taken in chunks without those hidden by its blockers
+        upcoming: List[List[int]] = [[] for _ in self.points]
+        # Last connections which crossed candidates of the point, far points are hidden by the same few
+        blockers: List[List[int]] = [[] for _ in self.points]
+        active = set(range(len(self.points)))
+        pending = list(reversed(range(len(self.points))))
+
+        def hide(i, chunk, segments):
+            if len(segments) != 0 and len(chunk) != 0:
+                chunk = chunk[~self.segments.blocked(self.points[i], coords[chunk], segments)]
+            # Reversed, the nearest point is popped first
+            upcoming[i] = chunk[::-1].tolist()
+
+        def candidate(i) -> Optional[int]:
+            while i in active:
+                if len(upcoming[i]) == 0:
+                    chunk = next(nearest[i], None)
+                    if chunk is None:
+                        active.discard(i)
+                        break
+                    hide(i, chunk, blockers[i])
+                    continue
+                j = upcoming[i][-1]
+                if j not in connected[i]:
+                    crossing = self.segments.crossing(self.points[i], self.points[j])
+                    if crossing is None:
+                        return j
+                    if crossing in blockers[i]:
+                        blockers[i].remove(crossing)
+                    blockers[i].insert(0, crossing)
+                    del blockers[i][16:]
+                    # The new blocker likely hides more of the chunk
+                    upcoming[i].pop()
+                    hide(i, np.array(upcoming[i][::-1], dtype=int), [crossing])
+                    continue
+                upcoming[i].pop()
+            return None
+
+        def any_candidate() -> bool:
+            while len(pending) != 0:
+                if candidate(pending[-1]) is not None:
+                    return True
+                pending.pop()
+            return False
+
+        while any_candidate():
+            point = random.choice(self.points)
+            dest = candidate(positions[point])
+            if dest is None:
                 continue
-            for dest in distances[point]:
-                if dest[0] in options:
-                    self.connections.append((point, dest[0]))
-                    break
+            self.connections.append((point, self.points[dest]))
+            self.segments.add(point, self.points[dest])
+            connected[positions[point]].add(dest)
+            connected[dest].add(positions[point])
 
         for connection in self.connections:
             print(connection[0], connection[1])
@@ -95,13 +334,11 @@ class Grid:
         return possible
 
     def check_intersect(self, new_line):  # (p1, p2)
-        for connection in self.connections:
-            if connection[0] not in [new_line[0], new_line[1]] and connection[1] not in [new_line[0], new_line[1]]:
-                line = LineString([connection[0].coords(), connection[1].coords()])
-                other = LineString([new_line[0].coords(), new_line[1].coords()])
-                if line.intersects(other):
-                    return True
-        return False
+        if self.segments is None or len(self.segments) != len(self.connections):
+            self.segments = SegmentIndex(PointIndex(self.points, self.x, self.y).size)
+            for connection in self.connections:
+                self.segments.add(connection[0], connection[1])
+        return bool(self.segments.crossings(new_line[0], new_line[1]).any())
 
     def draw_grid(self, colors: Dict[Point, str] = None):
         if colors is None:
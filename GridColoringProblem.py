@@ -1,10 +1,11 @@
-import cProfile
 import copy
-import pstats
 import time
 
+import numpy as np
+
 from Grid import Grid, Point
 from csp import Constraint, CSP
+from tables import compile_tables
 from typing import Dict, List, Optional
 import pprint
 
@@ -33,6 +34,8 @@ def results(solution, problem, grid, show_grid=False):
 
 
 class GridColoringConstraint(Constraint[Point, Point]):
+    value_symmetric = True
+
     def __init__(self, point1: Point, point2: Point):
         super().__init__([point1, point2])
         self.point1: Point = point1
@@ -43,6 +46,9 @@ class GridColoringConstraint(Constraint[Point, Point]):
             return True
         return assignment[self.point1] != assignment[self.point2]
 
+    def table(self, x_values: List[str], y_values: List[str]):
+        return np.array(x_values)[:, None] != np.array(y_values)[None, :]
+
 
 if __name__ == "__main__":
     grid = Grid(40, 40)
@@ -55,6 +61,7 @@ if __name__ == "__main__":
     csp: CSP[Point, str] = CSP(variables, domains)
     for connection in grid.connections:
         csp.add_constraint(GridColoringConstraint(connection[0], connection[1]))
+    compile_tables(csp)
 
     for lcv in [False, True]:
         for mcv in [False, True]:
@@ -94,3 +101,11 @@ if __name__ == "__main__":
                 print("Time:", (time.time() - start_time)*1000)
                 print("MAC:", mac_csp.steps, "Solutions:", len(solution_mac))
                 # results(solution_mac, mac_csp)
+
+    # Colors are interchangeable, only one coloring of every permutation class is searched for
+    sym_csp = copy.copy(csp)
+    start_time = time.time()
+    solutions_sym = sym_csp.maintain_arc_consistency(domains=csp.domains, symmetry=True) or []
+    print("Time:", (time.time() - start_time)*1000)
+    print("MAC symmetry:", sym_csp.steps, "Classes:", len(solutions_sym),
+          "Solutions:", sum(sym_csp.orbit_size(solution) for solution in solutions_sym))
@@ -0,0 +1,186 @@
+import asyncio
+import concurrent.futures
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+
+from csp import CSP, Budget, CancellationToken
+
+
+class AsyncSolver:
+    # Solves CSPs from asyncio code without blocking the event loop.
+    # By default a search runs in the loop itself in slices of slice_nodes assignments and gives
+    # control back to the loop after each slice, so many small solves are interleaved fairly.
+    # With threads, searches run on a thread pool owned by the solver instead.
+    # At most max_concurrent searches run at once, the others wait for a free place.
+    # Each search uses a copy of the CSP, so one CSP can be solved by many requests at once,
+    # its stats are added to csp.stats when it ends.
+    def __init__(self, slice_nodes=200, max_concurrent=64, threads: Optional[int] = None, queue_size=16):
+        self.slice_nodes = slice_nodes
+        self.max_concurrent = max_concurrent
+        self.threads = threads
+        # Solutions a thread may find ahead of the consumer of iter_solutions
+        self.queue_size = queue_size
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Created on first use, inside the running loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self.semaphore
+
+    async def iter_solutions(self, csp: CSP, method="bt", timeout: Optional[float] = None, limit=None,
+                             budget: Optional[Budget] = None, **kwargs) -> AsyncIterator[Dict]:
+        # Solutions as they are found, the search waits while the consumer does not ask for more.
+        # timeout (wall-clock seconds, including waiting for the consumer) ends the stream like
+        # a budget, budget.reason tells which limit stopped it. kwargs are those of CSP.iter_solutions.
+        if budget is None:
+            budget = Budget(timeout)
+        elif timeout is not None:
+            budget.seconds = timeout if budget.seconds is None else min(budget.seconds, timeout)
+        async with self._slots():
+            if self.threads is None:
+                solutions = self._iter_sliced(csp, method, limit, budget, kwargs)
+            else:
+                solutions = self._iter_threaded(csp, method, limit, budget, kwargs)
+            try:
+                async for solution in solutions:
+                    yield solution
+            finally:
+                await solutions.aclose()
+
+    async def solve(self, csp: CSP, method="bt", single=False, timeout: Optional[float] = None,
+                    budget: Optional[Budget] = None, **kwargs):
+        # Same results as CSP.solve, solutions found before the timeout when it runs out
+        solutions = self.iter_solutions(csp, method, timeout, 1 if single else None, budget, **kwargs)
+        try:
+            if single:
+                return await solutions.__anext__()
+            results: List[Dict] = [solution async for solution in solutions]
+        except StopAsyncIteration:
+            return None
+        finally:
+            await solutions.aclose()
+        if len(results) != 0:
+            return results
+        else:
+            return None
+
+    async def _iter_sliced(self, csp: CSP, method, limit, budget: Budget, kwargs) -> AsyncIterator[Dict]:
+        search = copy.copy(csp)
+        search.stats.reset()
+        solutions = search.iter_solutions(method, limit=limit, budget=budget, slice_nodes=self.slice_nodes, **kwargs)
+        try:
+            for solution in solutions:
+                if solution is None:
+                    # Let other tasks run between slices
+                    await asyncio.sleep(0)
+                else:
+                    yield solution
+        finally:
+            solutions.close()
+            csp.stats.add(search.stats)
+
+    async def _iter_threaded(self, csp: CSP, method, limit, budget: Budget, kwargs) -> AsyncIterator[Dict]:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="csp")
+        loop = asyncio.get_running_loop()
+        # Bounded, so a fast search blocks in its thread until the consumer catches up
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        cancel = budget.cancel
+        stop = CancellationToken()
+        if cancel is not None:
+            # The caller's token still cancels the search, checked together with stop
+            stop = _AnyToken(cancel, stop)
+        budget.cancel = stop
+        search = copy.copy(csp)
+        search.stats.reset()
+        done = object()
+
+        def put(item):
+            # Blocks the search thread while the queue is full
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not stop.is_set():
+                try:
+                    return future.result(0.05)
+                except concurrent.futures.TimeoutError:
+                    continue
+            future.cancel()
+
+        def run():
+            try:
+                for solution in search.iter_solutions(method, limit=limit, budget=budget, **kwargs):
+                    put(solution)
+                    if stop.is_set():
+                        break
+            except BaseException as error:
+                put(error)
+            put(done)
+
+        task = loop.run_in_executor(self.executor, run)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Consumer stopped or was cancelled, the search ends at its next node
+            stop.cancel()
+            await asyncio.shield(task)
+            budget.cancel = cancel
+            csp.stats.add(search.stats)
+
+
+class _AnyToken:
+    # Set when any of the tokens is set
+    def __init__(self, *tokens):
+        self.tokens = tokens
+
+    def is_set(self) -> bool:
+        return any(token.is_set() for token in self.tokens)
+
+    def cancel(self):
+        self.tokens[-1].set()
+
+
+async def solve_all(solver: AsyncSolver, problems: List[CSP], method="bt", single=False, timeout=None, **kwargs):
+    # Solves problems concurrently, results in the same order
+    return await asyncio.gather(*(solver.solve(problem, method, single, timeout, **kwargs) for problem in problems))
+
+
+if __name__ == "__main__":
+    import time
+    from benchmark import einstein, grid_coloring, queens
+
+    async def main():
+        problems = [einstein(seed=seed) for seed in range(20)] + [grid_coloring(12, 4, seed) for seed in range(20)]
+        for threads in (None, 4):
+            async with AsyncSolver(threads=threads) as solver:
+                start_time = time.time()
+                results = await solve_all(solver, problems, "fc", single=True, mcv=True)
+                print("Threads:", threads, "Solved:", sum(r is not None for r in results), "of", len(results),
+                      round((time.time() - start_time) * 1000), "ms")
+                # A slow instance with a timeout does not hold up the small ones
+                budget = Budget()
+                slow = asyncio.ensure_future(solver.solve(queens(30), "bt", timeout=0.5, budget=budget))
+                start_time = time.time()
+                await solve_all(solver, problems[:10], "fc", single=True, mcv=True)
+                print("Small solves next to a slow one:", round((time.time() - start_time) * 1000), "ms")
+                print("Slow one:", await slow is not None, budget.reason)
+
+    asyncio.run(main())
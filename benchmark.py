@@ -0,0 +1,323 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from csp import CSP, Budget, Constraint
+from EinsteinRiddleProblem import Variable, EinsteinUniqueConstraintNew, EinsteinNeighbourConstraint, \
+    EinsteinSameHouseConstraint, EinsteinHouseNumberConstraint
+from Grid import Grid
+from GridColoringProblem import GridColoringConstraint
+from preprocess import preprocess
+from tables import compile_tables
+
+COLORS = ["red", "green", "blue", "yellow", "cyan", "magenta", "orange", "purple"]
+
+
+class QueensConstraint(Constraint[int, int]):
+    # Queens in columns col1 and col2 (variables) are not in the same row or diagonal
+    def __init__(self, col1: int, col2: int):
+        super().__init__([col1, col2])
+        self.col1 = col1
+        self.col2 = col2
+
+    def satisfied(self, assignment: Dict[int, int]) -> bool:
+        if self.col1 not in assignment or self.col2 not in assignment:
+            return True
+        row1, row2 = assignment[self.col1], assignment[self.col2]
+        return row1 != row2 and abs(row1 - row2) != abs(self.col1 - self.col2)
+
+    def table(self, x_values: List[int], y_values: List[int]):
+        x = np.array(x_values)[:, None]
+        y = np.array(y_values)[None, :]
+        return (x != y) & (abs(x - y) != abs(self.col1 - self.col2))
+
+
+class RelationConstraint(Constraint[int, int]):
+    # Binary constraint given by its set of allowed pairs (value of x, value of y)
+    def __init__(self, x: int, y: int, allowed):
+        super().__init__([x, y])
+        self.x = x
+        self.y = y
+        self.allowed = allowed
+
+    def satisfied(self, assignment: Dict[int, int]) -> bool:
+        if self.x not in assignment or self.y not in assignment:
+            return True
+        return (assignment[self.x], assignment[self.y]) in self.allowed
+
+    def table(self, x_values: List[int], y_values: List[int]):
+        return [[(xv, yv) in self.allowed for yv in y_values] for xv in x_values]
+
+
+def grid_coloring(n, colors=4, seed=0) -> CSP:
+    side = max(10, int(math.sqrt(n) * 3))
+    grid = Grid(side, side)
+    # Grid seeds the global generator, the instance seed comes after it
+    random.seed(seed)
+    grid.random_points(n)
+    with contextlib.redirect_stdout(io.StringIO()):
+        grid.generate_connections()
+    domains = {point: COLORS[:colors] for point in grid.points}
+    problem = CSP(grid.points, domains)
+    for connection in grid.connections:
+        problem.add_constraint(GridColoringConstraint(connection[0], connection[1]))
+    return problem
+
+
+def einstein(n=5, seed=0, clues=None) -> CSP:
+    # Five categories of n items in n houses. Clues are drawn from a hidden random solution,
+    # so the puzzle always has a solution (not necessarily only one).
+    rng = random.Random(seed)
+    categories = ["nationality", "color", "drink", "pet", "tobacco"]
+    items = {c: [Variable(c, f"{c} {i}") for i in range(n)] for c in categories}
+    house = {}
+    for c in categories:
+        for variable, number in zip(items[c], rng.sample(range(1, n + 1), n)):
+            house[variable] = number
+    variables = [v for c in categories for v in items[c]]
+    problem = CSP(variables, {v: list(range(1, n + 1)) for v in variables})
+    for c in categories:
+        problem.add_constraint(EinsteinUniqueConstraintNew(items[c]))
+    by_house = {number: [v for v in variables if house[v] == number] for number in range(1, n + 1)}
+    for _ in range(3 * n if clues is None else clues):
+        kind = rng.choice(["same", "same", "left", "next", "number"])
+        a = rng.choice(variables)
+        if kind == "number":
+            problem.add_constraint(EinsteinHouseNumberConstraint(a, house[a]))
+        elif kind == "same":
+            b = rng.choice([v for v in by_house[house[a]] if v.category != a.category])
+            problem.add_constraint(EinsteinSameHouseConstraint(a, b))
+        else:
+            neighbours = [number for number in (house[a] - 1, house[a] + 1) if number in by_house]
+            if kind == "left" and house[a] + 1 in by_house:
+                problem.add_constraint(EinsteinNeighbourConstraint(a, rng.choice(by_house[house[a] + 1]), "LEFT"))
+            elif len(neighbours) != 0:
+                b = rng.choice(by_house[rng.choice(neighbours)])
+                problem.add_constraint(EinsteinNeighbourConstraint(a, b, "NEXT"))
+    return problem
+
+
+def queens(n) -> CSP:
+    columns = list(range(n))
+    problem = CSP(columns, {column: list(range(n)) for column in columns})
+    for col1 in columns:
+        for col2 in columns[col1 + 1:]:
+            problem.add_constraint(QueensConstraint(col1, col2))
+    return problem
+
+
+def random_binary(n, domain=5, density=0.3, tightness=0.4, seed=0) -> CSP:
+    # Model B: round(density * n(n-1)/2) constrained pairs of variables,
+    # each forbids round(tightness * domain^2) pairs of values
+    rng = random.Random(seed)
+    variables = list(range(n))
+    problem = CSP(variables, {v: list(range(domain)) for v in variables})
+    pairs = [(x, y) for x in variables for y in variables[x + 1:]]
+    values = [(a, b) for a in range(domain) for b in range(domain)]
+    for x, y in rng.sample(pairs, round(density * len(pairs))):
+        forbidden = set(rng.sample(values, round(tightness * len(values))))
+        problem.add_constraint(RelationConstraint(x, y, {pair for pair in values if pair not in forbidden}))
+    return problem
+
+
+def near_tree(n, domain=5, tightness=0.4, extra=0, seed=0) -> CSP:
+    # Random tree of n variables plus extra random edges, relations forbid round(tightness * domain^2) pairs
+    rng = random.Random(seed)
+    variables = list(range(n))
+    problem = CSP(variables, {v: list(range(domain)) for v in variables})
+    edges = {(rng.randrange(v), v) for v in variables[1:]}
+    pairs = [(x, y) for x in variables for y in variables[x + 1:] if (x, y) not in edges] if extra else []
+    edges.update(rng.sample(pairs, min(extra, len(pairs))))
+    values = [(a, b) for a in range(domain) for b in range(domain)]
+    for x, y in sorted(edges):
+        forbidden = set(rng.sample(values, round(tightness * len(values))))
+        problem.add_constraint(RelationConstraint(x, y, {pair for pair in values if pair not in forbidden}))
+    return problem
+
+
+# Instance families: size and options -> new CSP
+FAMILIES: Dict[str, Callable[..., CSP]] = {
+    "grid": lambda size, seed, options: grid_coloring(size, options.colors, seed),
+    "einstein": lambda size, seed, options: einstein(size, seed),
+    "queens": lambda size, seed, options: queens(size),
+    "random": lambda size, seed, options: random_binary(size, options.domain, options.density,
+                                                        options.tightness, seed),
+    "tree": lambda size, seed, options: near_tree(size, options.domain, options.tightness, options.extra, seed),
+}
+
+
+def family_params(family, options) -> str:
+    # Options which change the instances of family, part of the key of a record
+    if family == "grid":
+        return f"colors={options.colors}"
+    if family == "random":
+        return f"domain={options.domain},density={options.density},tightness={options.tightness}"
+    if family == "tree":
+        return f"domain={options.domain},tightness={options.tightness},extra={options.extra}"
+    return ""
+
+
+def run_search(make_csp: Callable[[], CSP], method, ordering, lcv, single, tables=False, timeout=None,
+               memory=False, preprocessing=None) -> Dict:
+    # preprocessing: None, "ac" or "sac", see preprocess.py. Its time is part of time_ms.
+    def prepare():
+        problem = make_csp()
+        if tables:
+            compile_tables(problem)
+        report = None
+        if preprocessing is not None:
+            problem, report = preprocess(problem, singleton=preprocessing == "sac")
+        return problem, report
+
+    problem, report = prepare()
+    budget = Budget(timeout)
+    start_time = time.perf_counter()
+    solutions = sum(1 for _ in problem.iter_solutions(method, lcv=lcv, ordering=ordering, limit=1 if single else None,
+                                                      budget=budget))
+    elapsed = time.perf_counter() - start_time + (0 if report is None else report.time)
+    stats = problem.stats
+    record = {"time_ms": round(elapsed * 1000, 3), "steps": stats.steps, "checks": stats.checks,
+              "prunes": stats.prunes, "revisions": stats.revisions, "backtracks": stats.backtracks,
+              "propagation_ms": round(stats.propagation_time * 1000, 3), "solutions": solutions,
+              "solutions_per_s": round(solutions / elapsed, 3) if elapsed > 0 else None,
+              "timeout": budget.reason == "time", "peak_kb": None,
+              "preprocess_ms": None if report is None else round(report.time * 1000, 3),
+              "removed": None if report is None else report.removed}
+    if memory:
+        # Separate run, tracing allocations slows the search down
+        problem, _ = prepare()
+        tracemalloc.start()
+        try:
+            sum(1 for _ in problem.iter_solutions(method, lcv=lcv, ordering=ordering, limit=1 if single else None,
+                                                  budget=Budget(timeout)))
+            record["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return record
+
+
+def run_suite(family, sizes, seeds=(0,), methods=CSP.methods, orderings=CSP.orderings, lcvs=(False, True),
+              single=False, options=None, tables=False, timeout=None, memory=False, echo=True,
+              preprocessing=None) -> List[Dict]:
+    # Every method with every combination of heuristics on every instance of the family
+    options = options or parse_args([])
+    records = []
+    for size in sizes:
+        for seed in seeds:
+            for method in methods:
+                for ordering in orderings:
+                    for lcv in lcvs:
+                        record = {"family": family, "size": size, "params": family_params(family, options),
+                                  "seed": seed, "method": method, "ordering": ordering or "none", "lcv": lcv,
+                                  "single": single, "preprocess": preprocessing}
+                        record.update(run_search(lambda: FAMILIES[family](size, seed, options), method, ordering,
+                                                 lcv, single, tables, timeout, memory, preprocessing))
+                        records.append(record)
+                        if echo:
+                            print(family, size, seed, method, record["ordering"], "lcv" if lcv else "-",
+                                  "Time:", record["time_ms"], "Steps:", record["steps"], "Checks:", record["checks"],
+                                  "Solutions:", record["solutions"],
+                                  "" if record["peak_kb"] is None else f"Peak: {record['peak_kb']} KB",
+                                  "TIMEOUT" if record["timeout"] else "")
+    return records
+
+
+KEY = ("family", "size", "params", "seed", "method", "ordering", "lcv", "single", "preprocess")
+
+
+def record_key(record) -> Tuple:
+    # Records written before a key was added have None for it
+    return tuple(str(record.get(k)) for k in KEY)
+
+
+def compare(records: List[Dict], baseline: List[Dict], tolerance=1.25, min_ms=5.0) -> List[str]:
+    # Differences to the baseline: slower than tolerance * baseline time (runs shorter than
+    # min_ms are too noisy) and any change of steps or solutions
+    base = {record_key(record): record for record in baseline}
+    regressions = []
+    for record in records:
+        old = base.get(record_key(record))
+        if old is None:
+            continue
+        name = " ".join(str(record.get(k)) for k in KEY)
+        if record["steps"] != old["steps"] or record["solutions"] != old["solutions"]:
+            regressions.append(f"{name}: steps {old['steps']} -> {record['steps']}, "
+                               f"solutions {old['solutions']} -> {record['solutions']}")
+        if record["time_ms"] > max(old["time_ms"], min_ms) * tolerance:
+            regressions.append(f"{name}: time {old['time_ms']} -> {record['time_ms']} ms")
+    return regressions
+
+
+def write_json(records: List[Dict], path):
+    with open(path, "w") as file:
+        json.dump(records, file, indent=1)
+
+
+def write_csv(records: List[Dict], path):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(records[0].keys()) if records else list(KEY))
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark of CSP search methods on seeded instance families")
+    parser.add_argument("family", nargs="?", default="grid", choices=sorted(FAMILIES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--methods", nargs="+", default=list(CSP.methods), choices=CSP.methods)
+    parser.add_argument("--orderings", nargs="+", default=[o or "none" for o in CSP.orderings],
+                        choices=[o or "none" for o in CSP.orderings])
+    parser.add_argument("--lcv", choices=["both", "on", "off"], default="both")
+    parser.add_argument("--single", action="store_true", help="stop at the first solution")
+    parser.add_argument("--colors", type=int, default=4, help="grid: number of colors")
+    parser.add_argument("--domain", type=int, default=5, help="random, tree: domain size")
+    parser.add_argument("--density", type=float, default=0.3, help="random: fraction of constrained pairs")
+    parser.add_argument("--tightness", type=float, default=0.4,
+                        help="random, tree: fraction of forbidden value pairs")
+    parser.add_argument("--extra", type=int, default=0, help="tree: edges added to the tree")
+    parser.add_argument("--tables", action="store_true", help="compile binary constraints to tables")
+    parser.add_argument("--preprocess", choices=["ac", "sac"], default=None,
+                        help="node and arc (or singleton arc) consistency before search")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds per search")
+    parser.add_argument("--memory", action="store_true", help="measure peak memory in a separate run")
+    parser.add_argument("--json", help="write records to this JSON file")
+    parser.add_argument("--csv", help="write records to this CSV file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown against the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    orderings = [None if o == "none" else o for o in options.orderings]
+    lcvs = {"both": (False, True), "on": (True,), "off": (False,)}[options.lcv]
+    records = run_suite(options.family, options.sizes, options.seeds, options.methods, orderings, lcvs,
+                        options.single, options, options.tables, options.timeout, options.memory,
+                        preprocessing=options.preprocess)
+    if options.json:
+        write_json(records, options.json)
+    if options.csv:
+        write_csv(records, options.csv)
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(records, json.load(file), options.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        print(len(regressions), "regressions")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
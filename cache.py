@@ -0,0 +1,76 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class ResultCache:
+    # Results of CSP.solve and CSP.count_solutions by key (fingerprint of the CSP and the options),
+    # set as csp.cache. At most capacity results are kept in memory, least recently used dropped first,
+    # results with more than max_solutions solutions are not kept.
+    # With path results are also pickled to files in that directory, so they are found again
+    # after being dropped from memory or in another process.
+    def __init__(self, capacity=1024, path: Optional[str] = None, max_solutions=10000):
+        self.capacity = capacity
+        self.path = path
+        self.max_solutions = max_solutions
+        self.entries: OrderedDict = OrderedDict()
+        # Results dropped from memory since the cache was made
+        self.evictions = 0
+        # Shared by copies of a CSP searching in threads
+        self.lock = threading.Lock()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def file(self, key) -> str:
+        return os.path.join(self.path, hashlib.sha256(repr(key).encode()).hexdigest() + ".pickle")
+
+    def get(self, key) -> Tuple[bool, object]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return True, self.entries[key]
+        if self.path is None:
+            return False, None
+        try:
+            with open(self.file(key), "rb") as file:
+                stored_key, result = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if stored_key != key:
+            return False, None
+        self.remember(key, result)
+        return True, result
+
+    def put(self, key, result) -> int:
+        # Returns the number of results dropped from memory
+        if isinstance(result, list) and len(result) > self.max_solutions:
+            return 0
+        if self.path is not None:
+            # Written to a temporary file first, so readers never see half a file
+            descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(descriptor, "wb") as file:
+                pickle.dump((key, result), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.file(key))
+        return self.remember(key, result)
+
+    def remember(self, key, result) -> int:
+        evicted = 0
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
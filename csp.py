@@ -1,21 +1,46 @@
-from typing import Generic, TypeVar, Dict, List
+from typing import Generic, TypeVar, Dict, FrozenSet, List, Optional, Set, Tuple
 from abc import abstractmethod
-import queue
-import itertools
+from collections import Counter, OrderedDict, deque
 import copy
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import sys
+import threading
+import time
 
 V = TypeVar('V')
 D = TypeVar('D')
 
 verbose = False
 
+# End of a search in CSP._stream, None marks a pause there
+_finished = object()
+# Subtree not searched yet in CSP._search
+_pending = object()
+
 
 def print_dicts(printable_dict):
     for k, v in printable_dict.items():
         print(k, v)
 
 
+def print_changes(store, token):
+    print("Modified domains:")
+    for i, old, _, _ in store.trail[token[0]:]:
+        print(store.variables[i], ": from", old, "to", store.values[i])
+
+
 class Constraint(Generic[V, D]):
+    # True when satisfied does not change if values are permuted (like x != y), used to detect
+    # interchangeable values
+    value_symmetric = False
+    # False when satisfied reads variables outside variables (the whole assignment). The constraint
+    # graph then does not show every dependency, so such problems are not decomposed.
+    scoped = True
+
     def __init__(self, variables: List[V]):
         self.variables = variables
 
@@ -23,297 +48,1393 @@ class Constraint(Generic[V, D]):
     def satisfied(self, assignment: Dict[V, D]) -> bool:
         pass
 
+    def table(self, x_values: List[D], y_values: List[D]):
+        # Binary constraints can return a boolean matrix [i][j] for x_values[i], y_values[j],
+        # None makes tables.compile_tables build it with satisfied
+        return None
+
+    def signature(self, positions: Dict[V, int]):
+        # Parameters of the constraint for CSP.fingerprint, by default all attributes except variables,
+        # with variables of the CSP replaced by their positions
+        names = sorted(n for n in getattr(self, "__dict__", {}) if n != "variables")
+        return tuple((n, canonical(getattr(self, n), positions)) for n in names)
+
+    def assigned_values(self, assignment: Dict[V, D]) -> List[D]:
+        # Scope-aware lookup: costs O(len(variables)) instead of scanning the whole assignment
+        return [assignment[v] for v in self.variables if v in assignment]
+
+
+def canonical(value, positions: Optional[Dict] = None):
+    # Text form of value which does not depend on the process (sets are sorted, objects need
+    # their own __repr__ or __str__ without an address), for fingerprints. Variables in positions become ("var", i).
+    if positions is not None:
+        try:
+            if value in positions:
+                return "var", positions[value]
+        except TypeError:
+            pass
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(v, positions) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return ("set",) + tuple(sorted((canonical(v, positions) for v in value), key=repr))
+    if isinstance(value, dict):
+        return ("dict",) + tuple(sorted(((canonical(k, positions), canonical(v, positions))
+                                         for k, v in value.items()), key=repr))
+    if hasattr(value, "tolist"):
+        return canonical(value.tolist(), positions)
+    kind = type(value)
+    # Functions and objects shown by address have no canonical form: a freed address is reused by
+    # another object, which would then get the same fingerprint
+    if callable(value):
+        raise TypeError(f"No canonical form of {kind.__qualname__}")
+    if kind.__repr__ is not object.__repr__:
+        text = repr(value)
+    elif kind.__str__ is not object.__str__:
+        text = str(value)
+    else:
+        raise TypeError(f"No canonical form of {kind.__qualname__}")
+    if " at 0x" in text:
+        raise TypeError(f"No canonical form of {kind.__qualname__}")
+    return f"{kind.__qualname__}:{text}"
+
+
+class AllDifferent(Constraint[V, D]):
+    value_symmetric = True
+
+    def satisfied(self, assignment: Dict[V, D]) -> bool:
+        values = self.assigned_values(assignment)
+        return len(values) == len(set(values))
+
+    def eliminate(self, variable: V, assignment: Dict[V, D], store) -> bool:
+        # Forward checking: value of variable is removed from unassigned variables of the scope
+        value = assignment[variable]
+        reason = frozenset((variable,))
+        for other in self.variables:
+            if other != variable and other not in assignment and value in store[other]:
+                store.set(other, [v for v in store[other] if v != value], reason)
+                if len(store[other]) == 0:
+                    return store.failed(other, self)
+        return True
+
+    def supported(self, value: D, domain: List[D]) -> bool:
+        # Arc support, assuming values of assigned variables are already removed from the domain
+        return len(domain) > 1 or (len(domain) == 1 and domain[0] != value)
+
 
 class Arc(Generic[V, D]):
-    def __init__(self, x: V, y: V, constraint: Constraint):
+    __slots__ = ("x", "y", "xi", "yi", "constraint", "table")
+
+    def __init__(self, x: V, y: V, constraint: Constraint, xi: int = -1, yi: int = -1):
         self.x = x
         self.y = y
+        # Ids of x and y in the CSP
+        self.xi = xi
+        self.yi = yi
         self.constraint = constraint
+        # Compiled compatibility table, see tables.compile_tables
+        self.table = None
 
     def __str__(self):
         return f"ARC:{self.x},{self.y}"
 
 
+class DomainStore(Generic[V, D]):
+    # Domains shared by the whole search. Instead of copying every domain per node,
+    # the first change of a domain after mark() saves the old list on the trail,
+    # and undo() puts the saved lists back when the search backtracks.
+    # With explaining on, every domain also keeps its reason: the assigned variables
+    # whose values caused its removals. Backjumping uses them as conflict sets.
+    # Variables have dense ids (their position in ids), domains and stamps are lists indexed by id,
+    # so the search can reach them without hashing variables.
+    def __init__(self, domains: Dict[V, List[D]], explaining=False, ids: Optional[Dict[V, int]] = None):
+        self.ids: Dict[V, int] = ids if ids is not None else {v: i for i, v in enumerate(domains)}
+        self.variables: List[V] = list(self.ids)
+        self.values: List[List[D]] = [list(domains[v]) for v in self.variables]
+        self.trail: List[Tuple[int, List[D], Optional[int], Optional[FrozenSet[V]]]] = []
+        self.stamps: List[Optional[int]] = [None] * len(self.variables)
+        self.epoch = 0
+        self.marks = 0
+        self.explaining = explaining
+        self.reasons: Dict[V, FrozenSet[V]] = {}
+        # Assigned variables and the constraint responsible for the last failed propagation
+        self.conflict: Set[V] = set()
+        self.culprit: Optional[Constraint[V, D]] = None
+        # Called with the id of a variable whenever its domain is replaced or restored
+        self.watch = None
+        # Counters of the search (SearchStats) and hook called with (variable, old, new) on every prune
+        self.stats = None
+        self.on_prune = None
+
+    def __getitem__(self, variable: V) -> List[D]:
+        return self.values[self.ids[variable]]
+
+    def __contains__(self, variable: V) -> bool:
+        return variable in self.ids
+
+    def __iter__(self):
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+    def keys(self):
+        return self.ids.keys()
+
+    def items(self):
+        return zip(self.variables, self.values)
+
+    def mark(self):
+        self.marks += 1
+        token = (len(self.trail), self.epoch)
+        self.epoch = self.marks
+        return token
+
+    def undo(self, token):
+        size, epoch = token
+        while len(self.trail) > size:
+            i, values, stamp, reason = self.trail.pop()
+            self.values[i] = values
+            self.stamps[i] = stamp
+            if self.explaining:
+                if reason is None:
+                    self.reasons.pop(self.variables[i], None)
+                else:
+                    self.reasons[self.variables[i]] = reason
+            if self.watch is not None:
+                self.watch(i)
+        self.epoch = epoch
+
+    def set(self, variable: V, values: List[D], reason: Optional[FrozenSet[V]] = None):
+        self.replace(self.ids[variable], values, reason)
+
+    def replace(self, i: int, values: List[D], reason: Optional[FrozenSet[V]] = None):
+        # Propagation removed values from the domain of variable with id i
+        if self.stats is not None:
+            self.stats.prunes += len(self.values[i]) - len(values)
+        if self.on_prune is not None:
+            self.on_prune(self.variables[i], self.values[i], values)
+        self.save(i)
+        self.values[i] = values
+        if self.explaining and reason:
+            variable = self.variables[i]
+            self.reasons[variable] = self.reasons.get(variable, frozenset()) | reason
+        if self.watch is not None:
+            self.watch(i)
+
+    def assign(self, variable: V, value: D):
+        i = self.ids[variable]
+        self.save(i)
+        self.values[i] = [value]
+        if self.explaining:
+            self.reasons[variable] = frozenset((variable,))
+        if self.watch is not None:
+            self.watch(i)
+
+    def save(self, i: int):
+        # The old list goes to the trail once per mark
+        if self.stamps[i] != self.epoch:
+            old_reason = self.reasons.get(self.variables[i]) if self.explaining else None
+            self.trail.append((i, self.values[i], self.stamps[i], old_reason))
+            self.stamps[i] = self.epoch
+
+    def failed(self, variable: V, constraint: Optional[Constraint[V, D]] = None) -> bool:
+        # Domain of variable was emptied by constraint, its reason is the conflict
+        self.culprit = constraint
+        if self.explaining:
+            self.conflict = set(self.reasons.get(variable, ()))
+        return False
+
+    def violated(self, constraint: Constraint[V, D], assignment: Dict[V, D]) -> bool:
+        # Constraint is not satisfied, its assigned variables are the conflict
+        self.culprit = constraint
+        if self.explaining:
+            self.conflict = {v for v in constraint.variables if v in assignment}
+        return False
+
+
+class NogoodStore(Generic[V, D]):
+    # Partial assignments known to have no solution, learned from conflict sets.
+    # Bounded: when full, the least recently learned or matched nogood is evicted.
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.nogoods: OrderedDict[FrozenSet[Tuple[V, D]], None] = OrderedDict()
+        self.index: Dict[Tuple[V, D], Set[FrozenSet[Tuple[V, D]]]] = {}
+        self.learned = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def add(self, nogood: Dict[V, D]):
+        key = frozenset(nogood.items())
+        if len(key) == 0:
+            return
+        if key in self.nogoods:
+            self.nogoods.move_to_end(key)
+            return
+        self.nogoods[key] = None
+        self.learned += 1
+        for item in key:
+            self.index.setdefault(item, set()).add(key)
+        if len(self.nogoods) > self.capacity:
+            old, _ = self.nogoods.popitem(last=False)
+            self.evicted += 1
+            for item in old:
+                self.index[item].discard(old)
+                if len(self.index[item]) == 0:
+                    del self.index[item]
+
+    def violated(self, variable: V, assignment: Dict[V, D]) -> Optional[FrozenSet[Tuple[V, D]]]:
+        # Nogood with the new value of variable which is contained in the assignment
+        items = assignment.items()
+        for nogood in self.index.get((variable, assignment[variable]), ()):
+            # Subset test of the items view, done without building a set
+            if items >= nogood:
+                self.nogoods.move_to_end(nogood)
+                return nogood
+        return None
+
+
+class VariableOrder(Generic[V, D]):
+    # Picks the next variable of a search. Unassigned variables are kept in a heap by key,
+    # the heap gets a new entry whenever a key can change (domain replaced or restored by
+    # the store, weights bumped, variable unassigned). Entries with an old key are dropped
+    # when they reach the top, so selecting a variable costs O(log n) instead of sorting.
+    #   None      - order of csp.variables
+    #   mrv       - smallest domain first (same choice as most_constrained_variable)
+    #   mrv-deg   - smallest domain, ties broken by most neighbours
+    #   dom/deg   - smallest domain size / number of neighbours
+    #   dom/wdeg  - smallest domain size / sum of weights of its constraints,
+    #               a constraint weight grows by one each time it causes a dead end
+    # With rng ties are broken by a random rank of every variable instead of its position.
+    def __init__(self, csp: "CSP[V, D]", store: DomainStore[V, D], assignment: Dict[V, D], heuristic=None,
+                 rng: Optional[random.Random] = None):
+        self.csp = csp
+        self.store = store
+        self.assignment = assignment
+        self.heuristic = heuristic
+        self.rank = None if rng is None else [rng.random() for _ in csp.variables]
+        # Heap entries are (key, id), ids follow the order of csp.variables
+        self.degree = [len(csp.arcs_from[v]) for v in csp.variables]
+        self.wdeg = [sum(csp.weights.get(c, 1) for c in csp.constraints[v] if len(c.variables) > 1)
+                     for v in csp.variables] if heuristic == "dom/wdeg" else None
+        self.heap = [(self.key(i), i) for i, v in enumerate(csp.variables) if v not in assignment]
+        heapq.heapify(self.heap)
+
+    def key(self, i: int):
+        if self.rank is not None:
+            return self.score(i), self.rank[i]
+        return self.score(i)
+
+    def score(self, i: int):
+        if self.heuristic is None:
+            return 0
+        size = len(self.store.values[i])
+        if self.heuristic == "mrv":
+            return size
+        if self.heuristic == "mrv-deg":
+            return size, -self.degree[i]
+        weight = self.degree[i] if self.heuristic == "dom/deg" else self.wdeg[i]
+        return size / weight if weight > 0 else float("inf")
+
+    def changed(self, i: int):
+        if self.heuristic is not None and self.csp.variables[i] not in self.assignment:
+            self.push(i)
+
+    def push(self, i: int):
+        heapq.heappush(self.heap, (self.key(i), i))
+        if len(self.heap) > 4 * len(self.degree) + 64:
+            # Too many old entries, rebuild from current keys
+            self.heap = [(self.key(j), j) for j, v in enumerate(self.csp.variables) if v not in self.assignment]
+            heapq.heapify(self.heap)
+
+    def select(self) -> V:
+        heap = self.heap
+        variables = self.csp.variables
+        while True:
+            key, i = heap[0]
+            if variables[i] not in self.assignment and (self.heuristic is None or key == self.key(i)):
+                return variables[i]
+            heapq.heappop(heap)
+
+    def failed(self, constraint: Optional[Constraint[V, D]]):
+        if self.heuristic != "dom/wdeg" or constraint is None:
+            return
+        self.csp.weights[constraint] = self.csp.weights.get(constraint, 1) + 1
+        if len(constraint.variables) > 1:
+            for v in constraint.variables:
+                i = self.csp.ids[v]
+                self.wdeg[i] += 1
+                self.changed(i)
+
+
+class SearchStats:
+    # Counters and timers of the searches of a CSP, accumulated until reset()
+    def __init__(self):
+        self.runs = 0
+        # Assignments tried and constraint checks
+        self.steps = 0
+        self.checks = 0
+        # Values removed from domains by propagation and arc revisions of ac3
+        self.prunes = 0
+        self.revisions = 0
+        # Assignments which failed right away, conflict-directed jumps and assignments cut by nogoods
+        self.backtracks = 0
+        self.backjumps = 0
+        self.nogood_prunes = 0
+        self.solutions = 0
+        # Searches stopped and started again, see restarts.py
+        self.restarts = 0
+        # Results found in the result cache, not found there and dropped from it
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        # Seconds spent searching for the solutions and in propagation only
+        self.search_time = 0.0
+        self.propagation_time = 0.0
+
+    def reset(self):
+        self.__init__()
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(vars(self))
+
+    def add(self, other: "SearchStats"):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def __str__(self):
+        return ", ".join(f"{k}: {round(v, 4) if isinstance(v, float) else v}" for k, v in vars(self).items())
+
+
+def memory_usage() -> int:
+    # Resident set size of the process in bytes, peak size where the current one is not known
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class CancellationToken(threading.Event):
+    # Shared with other threads, cancel() stops the searches using it at their next node
+    def cancel(self):
+        self.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.is_set()
+
+
+class Budget:
+    # Limits of a search run, None is no limit: wall-clock seconds, assignments tried, resident memory
+    # of the process in MB and a cancellation token (anything with is_set()).
+    # Once a limit is reached the search stops at the next node, keeping the solutions found until then.
+    # Memory is read every check_every nodes only.
+    def __init__(self, seconds: Optional[float] = None, nodes: Optional[int] = None,
+                 memory_mb: Optional[float] = None, cancel=None, check_every=256):
+        self.seconds = seconds
+        self.nodes = nodes
+        self.memory_mb = memory_mb
+        self.cancel = cancel
+        self.check_every = check_every
+        self.start()
+
+    def start(self, stats: Optional[SearchStats] = None):
+        # Called when a search starts, the limits count from here
+        self.deadline = None if self.seconds is None else time.perf_counter() + self.seconds
+        self.first_step = 0 if stats is None else stats.steps
+        self.countdown = self.check_every
+        # Limit which stopped the search: "time", "nodes", "memory" or "cancelled", None if none did
+        self.reason: Optional[str] = None
+        # Largest consistent partial assignment the search reached
+        self.best: Dict = {}
+
+    def exhausted(self, stats: SearchStats) -> bool:
+        if self.reason is not None:
+            return True
+        if self.cancel is not None and self.cancel.is_set():
+            self.reason = "cancelled"
+        elif self.nodes is not None and stats.steps - self.first_step >= self.nodes:
+            self.reason = "nodes"
+        elif self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.reason = "time"
+        elif self.memory_mb is not None:
+            self.countdown -= 1
+            if self.countdown <= 0:
+                self.countdown = self.check_every
+                if memory_usage() >= self.memory_mb * 1024 * 1024:
+                    self.reason = "memory"
+        return self.reason is not None
+
+    @property
+    def remaining_seconds(self) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - time.perf_counter())
+
+
+class _Frame:
+    # Variable assigned by CSP._search and the state of its loop over values
+    __slots__ = ("first", "values", "token", "conflict", "found", "propagated", "used")
+
+    def __init__(self, first, conflict: Optional[Set], propagated: bool):
+        self.first = first
+        # Interchangeable values used by the assignment, when symmetry is broken
+        self.used: Optional[FrozenSet] = None
+        self.values = None
+        # Trail mark of the current value, None while first is not assigned
+        self.token = None
+        self.conflict = conflict
+        self.found = False
+        self.propagated = propagated
+
+
+class SearchOptions:
+    # Settings of one search run, shared by all its nodes
+    def __init__(self, method="bt", lcv=False, mcv=False, propagation="ac3", backjump=False,
+                 nogoods: Optional[NogoodStore] = None, frontier=None, ordering=None, lcv_sample=None,
+                 budget: Optional[Budget] = None, slice_nodes=None, symmetry: Optional[Dict] = None,
+                 rng: Optional[random.Random] = None):
+        self.method = method
+        self.lcv = lcv
+        # Number of neighbours counted by approximate lcv, all if None
+        self.lcv_sample = lcv_sample
+        self.mcv = mcv
+        # mcv is the mrv ordering
+        self.ordering = ordering if ordering is not None else ("mrv" if mcv else None)
+        self.order: Optional[VariableOrder] = None
+        self.propagation = propagation
+        self.backjump = backjump
+        self.nogoods = nogoods
+        # Depth at which partial assignments are yielded instead of solutions
+        self.frontier = frontier
+        self.budget = budget
+        # Search pauses (yields None) at the first node after every slice_nodes assignments
+        self.slice_nodes = slice_nodes
+        self.pause_at = 0
+        # Interchangeable value -> index of its group, None without symmetry breaking
+        self.symmetry = symmetry
+        # Solutions counted instead of yielded when not None
+        self.count: Optional[int] = None
+        # Random tie-breaking of variables and values, None keeps their order
+        self.rng = rng
+        # Called with the assignment (not a copy) at every counted solution
+        self.sink = None
+
+    @property
+    def learning(self):
+        return self.backjump or self.nogoods is not None
+
+
 class CSP(Generic[V, D]):
+    methods = ("bt", "fc", "mac")
+    propagations = ("ac3", "ac2001")
+    orderings = (None, "mrv", "mrv-deg", "dom/deg", "dom/wdeg")
+
     def __init__(self, variables: List[V], domains: Dict[V, List[D]]):
         self.variables: List[V] = variables
+        # Dense ids of variables, used by the domain store and arcs instead of hashing variables
+        self.ids: Dict[V, int] = {v: i for i, v in enumerate(variables)}
         self.domains: Dict[V, List[D]] = domains
         self.constraints: Dict[V, List[Constraint[V, D]]] = {}
-        self.steps = 0
+        # Constraint graph, extended by add_constraint
+        self.arcs: List[Arc[V, D]] = []
+        self.arcs_from: Dict[V, List[Arc[V, D]]] = {}
+        self.arcs_to: Dict[V, List[Arc[V, D]]] = {}
+        self.constraint_arcs: Dict[Constraint[V, D], List[Arc[V, D]]] = {}
+        self.unary: Dict[V, List[Constraint[V, D]]] = {}
+        # Last supporting value for (arc, value), used by ac2001 propagation
+        self.supports: Dict[Tuple[Arc[V, D], D], D] = {}
+        # Constraint weights for dom/wdeg ordering, 1 if missing
+        self.weights: Dict[Constraint[V, D], int] = {}
+        # Support counts of lcv for (arc, domain of y, values of the scope), least recently used evicted first
+        self.lcv_cache: OrderedDict[Tuple, Dict[D, int]] = OrderedDict()
+        self.lcv_cache_size = 100000
+        # Groups of values which can be permuted in any solution, giving another solution
+        self.interchangeable: List[List[D]] = []
+        # Results of solve and count_solutions by fingerprint and options, see cache.ResultCache
+        self.cache = None
+        # (domains it was computed for, fingerprint), cleared by add_constraint and add_interchangeable
+        self.fingerprinted: Optional[Tuple] = None
+        self.stats = SearchStats()
+        # Event-like object (is_set), when set the search stops at the next node
+        self.interrupt = None
+        # Hooks, None when not used:
+        #   on_assign(variable, value, depth)   - value is tried for variable
+        #   on_prune(variable, old, new)        - propagation replaced the domain old by new
+        #   on_backtrack(variable, value, constraint) - assignment failed, constraint caused it (None for nogoods)
+        #   on_solution(solution)
+        self.on_assign = None
+        self.on_prune = None
+        self.on_backtrack = None
+        self.on_solution = None
+        # Directory for a pstats file of every search, see profiling.py.
+        # profile_interval is the sampling period in seconds, None profiles every call with cProfile.
+        self.profile: Optional[str] = None
+        self.profile_interval: Optional[float] = 0.001
 
         for variable in self.variables:
             self.constraints[variable] = []
+            self.arcs_from[variable] = []
+            self.arcs_to[variable] = []
+            self.unary[variable] = []
             if variable not in self.domains:
                 raise LookupError("Variable must have a domain!")
 
+    def __copy__(self):
+        # Copies share the constraints, but count their own searches. State changed by searches
+        # (supports, weights and lcv counts) is their own too, so copies can search in threads.
+        other = object.__new__(type(self))
+        other.__dict__.update(self.__dict__)
+        other.stats = copy.copy(self.stats)
+        other.supports = dict(self.supports)
+        other.weights = dict(self.weights)
+        other.lcv_cache = OrderedDict()
+        return other
+
+    # Counters kept in stats
+    @property
+    def steps(self) -> int:
+        return self.stats.steps
+
+    @steps.setter
+    def steps(self, value: int):
+        self.stats.steps = value
+
+    @property
+    def checks(self) -> int:
+        return self.stats.checks
+
+    @checks.setter
+    def checks(self, value: int):
+        self.stats.checks = value
+
+    @property
+    def backjumps(self) -> int:
+        return self.stats.backjumps
+
+    @backjumps.setter
+    def backjumps(self, value: int):
+        self.stats.backjumps = value
+
+    @property
+    def nogood_prunes(self) -> int:
+        return self.stats.nogood_prunes
+
+    @nogood_prunes.setter
+    def nogood_prunes(self, value: int):
+        self.stats.nogood_prunes = value
+
     def add_constraint(self, constraint: Constraint[V, D]):
+        self.fingerprinted = None
         for variable in constraint.variables:
-            if variable not in self.variables:
+            if variable not in self.ids:
                 raise LookupError("No variable in CSP")
             else:
                 self.constraints[variable].append(constraint)
+        if len(constraint.variables) > 1:
+            self.constraint_arcs[constraint] = []
+            for x, y in itertools.permutations(constraint.variables, 2):
+                arc = Arc(x, y, constraint, self.ids[x], self.ids[y])
+                self.arcs.append(arc)
+                self.arcs_from[x].append(arc)
+                self.arcs_to[y].append(arc)
+                self.constraint_arcs[constraint].append(arc)
+        else:
+            self.unary[constraint.variables[0]].append(constraint)
 
     def consistent(self, variable: V, assignment: Dict[V, D]) -> bool:
+        return self.violated(variable, assignment) is None
+
+    def violated(self, variable: V, assignment: Dict[V, D]) -> Optional[Constraint[V, D]]:
         for constraint in self.constraints[variable]:
+            self.stats.checks += 1
             if not constraint.satisfied(assignment):
-                return False
-        return True
+                return constraint
+        return None
 
-    def forward_checking(self, domains, single=False, assignment={}, lcv=False, mcv=False):
-        results = []
-        if len(assignment) == len(self.variables):
-            if single:
-                return assignment
-            return [assignment]
-        unassigned: List[V] = [v for v in self.variables if v not in assignment]
-        # Check mcv heuristic
-        if mcv:
-            unassigned = self.most_constrained_variable(domains, unassigned)
-        first: V = unassigned[0]
-        # Values order with or without heuristic
-        for value in domains[first] if not lcv else self.lcv(domains, assignment, first):
-            mutable_domain = copy.deepcopy(domains)
-            local_assignment = assignment.copy()
-
-            local_assignment[first] = value
-            self.steps += 1
-            mutable_domain[first] = [value]
-
-            if not self.check_fc(mutable_domain, local_assignment, first):
-                # Dead end found
-                if verbose:
-                    print("Assignment:")
-                    print_dicts(local_assignment)
-                    print("causes dead end, because:")
-                    print_dicts(mutable_domain)
-                continue
-            else:
-                # Continue in this direction
-                if verbose:
-                    print("Modified domains:")
-                    for k in mutable_domain.keys():
-                        print(k, ": from", domains[k], "to", mutable_domain[k])
-                result = self.forward_checking(mutable_domain, single, local_assignment, lcv, mcv)
-                if result is not None:
-                    if single:
-                        return result
-                    results.extend(result)
+    def iter_solutions(self, method="bt", domains=None, assignment=None, lcv=False, mcv=False, limit=None,
+                       propagation="ac3", backjump=False, nogoods: Optional[NogoodStore] = None, ordering=None,
+                       lcv_sample=None, budget: Optional[Budget] = None, slice_nodes=None, symmetry=False,
+                       seed=None):
+        # Solutions are yielded as soon as they are found. Search is paused between solutions,
+        # so stopping the iteration (or reaching limit) cancels the rest of the search.
+        # When budget runs out the iteration ends, budget.reason tells why.
+        # With slice_nodes None is yielded after about that many assignments, so the caller
+        # can run the search in slices (see async_solver.py).
+        # With symmetry only one solution of every class of solutions differing by a permutation of
+        # interchangeable values is searched for, see expand and orbit_size.
+        # With a seed ties of the variable ordering and values in domain (or lcv) order are broken
+        # at random, the same way for the same seed.
+        options = SearchOptions(method, lcv, mcv, propagation, backjump, nogoods, ordering=ordering,
+                                lcv_sample=lcv_sample, budget=budget, slice_nodes=slice_nodes,
+                                symmetry=self.symmetry_groups() if symmetry else None,
+                                rng=None if seed is None else random.Random(seed))
+        store, assignment = self._prepare(options, domains, assignment)
+        return self._stream(self._search(options, store, assignment), limit)
+
+    def iter_subproblems(self, method="bt", depth=1, domains=None, assignment=None, lcv=False, mcv=False,
+                         propagation="ac3", budget: Optional[Budget] = None, symmetry=False):
+        # Pairs (assignment, domains) after assigning depth more variables and propagating.
+        # Searching all of them gives the same solutions as searching from the start.
+        options = SearchOptions(method, lcv, mcv, propagation, budget=budget,
+                                symmetry=self.symmetry_groups() if symmetry else None)
+        store, assignment = self._prepare(options, domains, assignment)
+        options.frontier = len(assignment) + depth
+        return self._search(options, store, assignment)
+
+    def _prepare(self, options: SearchOptions, domains, assignment):
+        if options.method not in self.methods:
+            raise ValueError(f"Unknown search method: {options.method}")
+        if options.propagation not in self.propagations:
+            raise ValueError(f"Unknown propagation: {options.propagation}")
+        if options.ordering not in self.orderings:
+            raise ValueError(f"Unknown variable ordering: {options.ordering}")
+        if domains is None:
+            domains = self.domains
+        if isinstance(domains, DomainStore) and (domains.ids is self.ids or domains.ids == self.ids):
+            store = domains
+        else:
+            store = DomainStore(domains, ids=self.ids)
+        store.explaining = options.learning
+        store.stats = self.stats
+        store.on_prune = self.on_prune
+        assignment = {} if assignment is None else assignment.copy()
+        # Domains of variables assigned by the caller hold only their values, as after an assignment
+        # in the search. Propagation (AllDifferent.supported and tables) relies on it.
+        for variable, value in assignment.items():
+            if store[variable] != [value]:
+                store.assign(variable, value)
+        if options.symmetry is not None:
+            # Only groups kept by the domains actually searched
+            options.symmetry = self.symmetry_groups(store, assignment)
+        options.order = VariableOrder(self, store, assignment, options.ordering, options.rng)
+        if options.ordering is not None:
+            store.watch = options.order.changed
+        if options.budget is not None:
+            options.budget.start(self.stats)
+        if options.slice_nodes is not None:
+            options.pause_at = self.stats.steps + options.slice_nodes
+        return store, assignment
+
+    def _stream(self, solutions, limit):
+        # Solutions up to limit, search time and hooks are counted only while the search runs
+        self.stats.runs += 1
+        profiler = None
+        if self.profile is not None:
+            from profiling import make_profiler
+            profiler = make_profiler(self.profile_interval)
+        found = 0
+        try:
+            while limit is None or found < limit:
+                start_time = time.perf_counter()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    solution = next(solutions, _finished)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    self.stats.search_time += time.perf_counter() - start_time
+                if solution is _finished:
+                    return
+                if solution is None:
+                    # End of a slice
+                    yield None
+                    continue
+                found += 1
+                self.stats.solutions += 1
+                if self.on_solution is not None:
+                    self.on_solution(solution)
+                yield solution
+        finally:
+            solutions.close()
+            if profiler is not None:
+                os.makedirs(self.profile, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.profile, f"search-{self.stats.runs}.pstats"))
+
+    def solve(self, method="bt", domains=None, single=False, assignment=None, lcv=False, mcv=False,
+              propagation="ac3", backjump=False, nogoods: Optional[NogoodStore] = None, ordering=None,
+              lcv_sample=None, budget: Optional[Budget] = None, symmetry=False, seed=None):
+        # With a budget the solutions found before it ran out are returned.
+        # With a cache, results of complete searches are kept and returned again without searching.
+        key = None
+        if self.cache is not None and nogoods is None:
+            key = self.cache_key("solve", domains, assignment, method, single, lcv, mcv, propagation, backjump,
+                                 ordering, lcv_sample, symmetry, seed)
+            found, stored = self.cache_get(key)
+            if found:
+                if stored is None:
+                    return None
+                if single:
+                    return dict(zip(self.variables, stored))
+                return [dict(zip(self.variables, values)) for values in stored]
+        solutions = self.iter_solutions(method, domains, assignment, lcv, mcv, 1 if single else None, propagation,
+                                        backjump, nogoods, ordering, lcv_sample, budget, symmetry=symmetry,
+                                        seed=seed)
         if single:
-            return None
+            result = next(solutions, None)
+            solutions.close()
+            self.cache_put(key, budget, None if result is None else tuple(result[v] for v in self.variables))
+            return result
+        results = list(solutions)
+        self.cache_put(key, budget, [tuple(r[v] for v in self.variables) for r in results] or None)
         if len(results) != 0:
             return results
         else:
             return None
 
-    def check_fc(self, domains, assignment, variable):
-        # variable already assigned
-        unary = []
-        neighbours = []
-        for c in self.constraints[variable]:
-            if len([v for v in c.variables if v not in assignment or v == variable]) > 1:
-                # Find all arcs with unassigned neighbours
-                arcs = list(itertools.permutations(c.variables, 2))
-                arcs = [arc for arc in arcs if arc[0] == variable and arc[1] not in assignment]
-                for arc in arcs:
-                    new_arc = Arc(arc[0], arc[1], c)
-                    neighbours.append(new_arc)
+    def fingerprint(self) -> str:
+        # Hash of variables, domains, constraints (class, scope and signature) and declared interchangeable
+        # values, the same for equal CSPs built in any process and with constraints added in any order.
+        # TypeError if a value has no canonical form. Kept until a constraint or interchangeable values
+        # are added or domains change.
+        domains = tuple(tuple(self.domains[v]) for v in self.variables)
+        if self.fingerprinted is not None and self.fingerprinted[0] == domains:
+            return self.fingerprinted[1]
+        positions = self.ids
+        constraints = set()
+        for variable in self.variables:
+            for constraint in self.constraints[variable]:
+                constraints.add(constraint)
+        described = sorted((repr((f"{type(c).__module__}.{type(c).__qualname__}",
+                                  tuple(positions[v] for v in c.variables), c.signature(positions)))
+                            for c in constraints))
+        text = repr((tuple(canonical(v) for v in self.variables),
+                     tuple(canonical(list(self.domains[v])) for v in self.variables), described,
+                     sorted(repr(canonical(frozenset(group))) for group in self.interchangeable)))
+        self.fingerprinted = (domains, hashlib.sha256(text.encode()).hexdigest())
+        return self.fingerprinted[1]
+
+    def cache_key(self, kind, domains, assignment, *options) -> Optional[Tuple]:
+        # Key of a result in self.cache, None when the problem has no fingerprint
+        try:
+            if domains is not None and domains is not self.domains:
+                domains = tuple(canonical(list(domains[v])) for v in self.variables)
             else:
-                unary.append(c)
+                domains = None
+            if assignment:
+                assignment = canonical(assignment, self.ids)
+            return self.fingerprint(), kind, domains, assignment, repr(options)
+        except TypeError:
+            return None
+
+    def cache_get(self, key):
+        # (True, result) when key is in the cache, counted as a hit or a miss
+        if key is None:
+            return False, None
+        evictions = self.cache.evictions
+        found, stored = self.cache.get(key)
+        # Results read from disk can push others out of memory
+        self.stats.cache_evictions += self.cache.evictions - evictions
+        if found:
+            self.stats.cache_hits += 1
+        else:
+            self.stats.cache_misses += 1
+        return found, stored
+
+    def cache_put(self, key, budget: Optional[Budget], stored):
+        # Only results of searches which were not stopped early
+        if key is None or budget is not None and budget.reason is not None:
+            return
+        if self.interrupt is not None and self.interrupt.is_set():
+            return
+        self.stats.cache_evictions += self.cache.put(key, stored)
+
+    def count_solutions(self, method="bt", domains=None, lcv=False, mcv=False, propagation="ac3", ordering=None,
+                        decompose=True, symmetry=False, budget: Optional[Budget] = None, sink=None) -> int:
+        # Number of solutions, no solution is built. With decompose every connected component of
+        # the constraint graph is counted on its own and the counts are multiplied.
+        # With symmetry one solution of every class is searched and the class sizes are added up.
+        # When the budget runs out (budget.reason is set) the result is not the full count.
+        # The count does not depend on the method, so the cached one is used for any method.
+        # sink(assignment) is called with every solution found (the live assignment, copy it to keep it),
+        # the problem is not decomposed then.
+        key = None
+        if self.cache is not None and sink is None:
+            key = self.cache_key("count", domains, None)
+            found, stored = self.cache_get(key)
+            if found:
+                return stored
+        if domains is None:
+            domains = self.domains
+        parts = self.components() if decompose and sink is None else [self.variables]
+        counts = []
+
+        def search():
+            for variables in parts:
+                sub = self if len(parts) == 1 else self.subproblem(variables)
+                sub.stats = self.stats
+                options = SearchOptions(method, lcv, mcv, propagation, ordering=ordering,
+                                        symmetry=sub.symmetry_groups() if symmetry else None)
+                options.count = 0
+                options.sink = sink
+                store, assignment = sub._prepare(options, {v: domains[v] for v in variables}, None)
+                # Started once for all components
+                options.budget = budget
+                yield from sub._search(options, store, assignment)
+                counts.append(options.count)
+                if options.count == 0 or budget is not None and budget.reason is not None:
+                    return
+
+        if budget is not None:
+            budget.start(self.stats)
+        for _ in self._stream(search(), None):
+            pass
+        total = 1
+        for count in counts:
+            total *= count
+        self.stats.solutions += total
+        self.cache_put(key, budget, total)
+        return total
+
+    def components(self) -> List[List[V]]:
+        # Variables of the connected components of the constraint graph, each in the order of variables.
+        # All variables are one component when some constraint is not scoped.
+        if not all(c.scoped for v in self.variables for c in self.constraints[v]):
+            return [list(self.variables)]
+        seen = set()
+        parts = []
+        for variable in self.variables:
+            if variable in seen:
+                continue
+            seen.add(variable)
+            part = []
+            queue = deque([variable])
+            while len(queue) != 0:
+                v = queue.popleft()
+                part.append(v)
+                for constraint in self.constraints[v]:
+                    for w in constraint.variables:
+                        if w not in seen:
+                            seen.add(w)
+                            queue.append(w)
+            parts.append(sorted(part, key=self.ids.__getitem__))
+        return parts
+
+    def subproblem(self, variables: List[V], domains=None, unary=True) -> "CSP[V, D]":
+        # CSP of variables and the constraints among them, sharing compiled tables of arcs.
+        # Without unary the scoped constraints of one variable are left out, domains must satisfy them then.
+        if domains is None:
+            domains = self.domains
+        sub: CSP[V, D] = CSP(variables, {v: list(domains[v]) for v in variables})
+        inside = set(variables)
+        added = set()
+        for v in variables:
+            for constraint in self.constraints[v]:
+                if not unary and len(constraint.variables) == 1 and constraint.scoped:
+                    continue
+                if constraint not in added and all(w in inside for w in constraint.variables):
+                    added.add(constraint)
+                    sub.add_constraint(constraint)
+        tables = {(arc.x, arc.y, arc.constraint): arc.table for arc in self.arcs if arc.table is not None}
+        for arc in sub.arcs:
+            arc.table = tables.get((arc.x, arc.y, arc.constraint))
+        sub.interchangeable = self.interchangeable
+        sub.interrupt = self.interrupt
+        sub.on_assign = self.on_assign
+        sub.on_prune = self.on_prune
+        sub.on_backtrack = self.on_backtrack
+        return sub
+
+    def _search(self, options: SearchOptions, store: DomainStore, assignment, propagated=False):
+        # Yields solutions of the subtree. With learning it returns the conflict set of the subtree:
+        # assigned variables which must change to make it solvable, None if it had solutions.
+        # Depth first with an explicit stack, one frame for every variable assigned here, so deep
+        # searches are not limited by the recursion limit.
+        learning = options.learning
+        budget = options.budget
+        order = options.order
+        nogoods = options.nogoods
+        stats = self.stats
+        n = len(self.variables)
+        stack: List[_Frame] = []
+        try:
+            while True:
+                # Node of the current assignment, result is set when it has no children
+                result = _pending
+                if self.interrupt is not None and self.interrupt.is_set():
+                    # Checked before leaves too, no solution is given after the interrupt
+                    result = None
+                elif options.frontier is not None and len(assignment) in (options.frontier, n):
+                    yield assignment.copy(), {v: list(values) for v, values in store.items()}
+                    result = None
+                elif len(assignment) == n:
+                    if options.count is None:
+                        yield assignment.copy()
+                    else:
+                        if options.sink is not None:
+                            options.sink(assignment)
+                        if options.symmetry is None:
+                            options.count += 1
+                        else:
+                            # The solution stands for its whole class
+                            if len(stack) == 0:
+                                used = {v for v in assignment.values() if v in options.symmetry}
+                            else:
+                                used = stack[-1].used | {assignment[stack[-1].first]}
+                            options.count += self.orbit(used, options.symmetry)
+                    result = None
+                else:
+                    if options.slice_nodes is not None and stats.steps >= options.pause_at:
+                        options.pause_at = stats.steps + options.slice_nodes
+                        yield None
+                    if budget is not None:
+                        # Stopped subtrees return None, so no conflict or nogood is learned from them
+                        if budget.exhausted(stats):
+                            result = None
+                        elif len(assignment) > len(budget.best):
+                            budget.best = assignment.copy()
+                if result is _pending:
+                    first: V = order.select()
+                    # Values removed from the domain of first are also part of its conflict
+                    frame = _Frame(first, set(store.reasons.get(first, ())) if learning else None,
+                                   propagated if len(stack) == 0 else True)
+                    stack.append(frame)
+                    # Values order with or without heuristic
+                    if options.lcv:
+                        values = self.lcv(store, assignment, first, options.lcv_sample, options.rng)
+                    elif options.rng is not None:
+                        values = options.rng.sample(store[first], len(store[first]))
+                    else:
+                        values = store[first]
+                    if options.symmetry is not None:
+                        if len(stack) == 1:
+                            frame.used = frozenset(v for v in assignment.values() if v in options.symmetry)
+                        else:
+                            parent = stack[-2]
+                            value = assignment[parent.first]
+                            frame.used = parent.used | {value} if value in options.symmetry else parent.used
+                        values = self.break_symmetry(values, options.symmetry, frame.used)
+                    frame.values = iter(values)
+
+                # Next value of the deepest frame, finished frames pass their result up
+                while len(stack) != 0:
+                    frame = stack[-1]
+                    first = frame.first
+                    if result is not _pending:
+                        # Subtree below the current value of first is done
+                        jump = False
+                        if not learning:
+                            pass
+                        elif result is None:
+                            frame.found = True
+                        elif first in result or not options.backjump:
+                            frame.conflict.update(result)
+                        else:
+                            # No other value of first can solve the subtree, jump back over first
+                            stats.backjumps += 1
+                            jump = True
+                        store.undo(frame.token)
+                        frame.token = None
+                        del assignment[first]
+                        if jump:
+                            stack.pop()
+                            order.push(self.ids[first])
+                            continue
+                        result = _pending
+                    stopped = False
+                    for value in frame.values:
+                        # Remaining values of every frame are skipped, not assigned one by one
+                        if self.interrupt is not None and self.interrupt.is_set() or \
+                                budget is not None and budget.exhausted(stats):
+                            stopped = True
+                            break
+                        token = frame.token = store.mark()
+                        assignment[first] = value
+                        stats.steps += 1
+                        if self.on_assign is not None:
+                            self.on_assign(first, value, len(assignment))
+                        nogood = None if nogoods is None else nogoods.violated(first, assignment)
+                        if nogood is not None:
+                            # Known dead end
+                            stats.nogood_prunes += 1
+                            stats.backtracks += 1
+                            if self.on_backtrack is not None:
+                                self.on_backtrack(first, value, None)
+                            frame.conflict.update(v for v, _ in nogood)
+                        elif self.propagate(options, store, assignment, first, frame.propagated):
+                            # Continue in this direction
+                            if verbose and options.method != "bt":
+                                print_changes(store, token)
+                            break
+                        else:
+                            stats.backtracks += 1
+                            if self.on_backtrack is not None:
+                                self.on_backtrack(first, value, store.culprit)
+                            order.failed(store.culprit)
+                            if learning:
+                                frame.conflict.update(store.conflict)
+                            if verbose and options.method != "bt":
+                                # Dead end found
+                                print("Assignment:")
+                                print_dicts(assignment)
+                                print("causes dead end, because:")
+                                print_dicts(store)
+                        store.undo(token)
+                        frame.token = None
+                        del assignment[first]
+                    if frame.token is not None:
+                        # Descend to the node of the new assignment
+                        break
+                    stack.pop()
+                    order.push(self.ids[first])
+                    if stopped or not learning or frame.found:
+                        result = None
+                    else:
+                        frame.conflict.discard(first)
+                        if nogoods is not None:
+                            nogoods.add({v: assignment[v] for v in frame.conflict})
+                        result = frame.conflict
+                else:
+                    return result
+        finally:
+            # Search closed or failed in the middle, take back its assignments
+            while len(stack) != 0:
+                frame = stack.pop()
+                if frame.token is not None:
+                    store.undo(frame.token)
+                    assignment.pop(frame.first, None)
+                order.push(self.ids[frame.first])
+
+    def propagate(self, options: SearchOptions, store: DomainStore, assignment, first, propagated=False) -> bool:
+        # propagated: domains are already consistent with the rest of the assignment
+        start_time = time.perf_counter()
+        try:
+            if options.method == "bt":
+                constraint = self.violated(first, assignment)
+                return constraint is None or store.violated(constraint, assignment)
+            store.assign(first, assignment[first])
+            if options.method == "fc":
+                return self.check_fc(store, assignment, first)
+            return self.ac3(assignment, store, first, options.propagation, propagated)
+        finally:
+            self.stats.propagation_time += time.perf_counter() - start_time
+
+    def forward_checking(self, domains, single=False, assignment={}, lcv=False, mcv=False, backjump=False,
+                         nogoods: Optional[NogoodStore] = None, budget: Optional[Budget] = None, symmetry=False):
+        return self.solve("fc", domains, single, assignment, lcv, mcv, backjump=backjump, nogoods=nogoods,
+                          budget=budget, symmetry=symmetry)
+
+    def check_fc(self, store: DomainStore, assignment, variable):
+        # variable already assigned
+        # Find all arcs with unassigned neighbours, constraints without them are only checked
+        neighbours = [arc for arc in self.arcs_from[variable]
+                      if arc.y not in assignment and not isinstance(arc.constraint, AllDifferent)]
+        unary = [c for c in self.constraints[variable] if all(v in assignment for v in c.variables)]
+        different = [c for c in self.constraints[variable] if isinstance(c, AllDifferent) and c not in unary]
 
         # Check unary constraints
         for c in unary:
+            self.stats.checks += 1
             if not c.satisfied(assignment):
                 if verbose:
                     print("Unary fail")
+                return store.violated(c, assignment)
+        # Global constraints filter the domains themselves
+        for c in different:
+            self.stats.checks += 1
+            if not c.eliminate(variable, assignment, store):
+                if verbose:
+                    print("All different fail")
                 return False
         # Check constraints with neighbours
         localassignment = {variable: assignment[variable]}
+        reason = frozenset((variable,))
+        domains = store.values
 
         for neighbour in neighbours:
-            new_domain = copy.deepcopy(domains[neighbour.y])
-            for yv in domains[neighbour.y]:
-                localassignment[neighbour.y] = yv
-                # Remove value from domain if it doesn't satisfy constrain
-                if not neighbour.constraint.satisfied(localassignment):
-                    new_domain.remove(yv)
+            if neighbour.table is not None:
+                new_domain = neighbour.table.filter(localassignment[variable], domains[neighbour.yi])
+                self.stats.checks += 1
+            else:
+                new_domain = []
+                for yv in domains[neighbour.yi]:
+                    localassignment[neighbour.y] = yv
+                    self.stats.checks += 1
+                    # Keep only values which satisfy constraint
+                    if neighbour.constraint.satisfied(localassignment):
+                        new_domain.append(yv)
 
             if len(new_domain) == 0:
                 # If neighbour out of values -> dead end
-                domains[neighbour.y] = new_domain
+                store.replace(neighbour.yi, new_domain, reason)
                 if verbose:
                     print("Binary fail")
-                return False
+                return store.failed(neighbour.y, neighbour.constraint)
 
-            if len(new_domain) != len(domains[neighbour.y]):
+            if len(new_domain) != len(domains[neighbour.yi]):
                 # Update domain
-                domains[neighbour.y] = new_domain
+                store.replace(neighbour.yi, new_domain, reason)
 
             localassignment.pop(neighbour.y, None)
         return True
 
-    def maintain_arc_consistency(self, domains, single=False, assignment={}, lcv=False, mcv=False):
-        results = []
-        if len(assignment) == len(self.variables):
-            if single:
-                return assignment
-            return [assignment]
-        unassigned: List[V] = [v for v in self.variables if v not in assignment]
-        if mcv:
-            unassigned = self.most_constrained_variable(domains, unassigned)
-        first: V = unassigned[0]
-
-        for value in domains[first] if not lcv else self.lcv(domains, assignment, first):
-            mutable_domain = copy.deepcopy(domains)
-            local_assignment = assignment.copy()
-
-            local_assignment[first] = value
-            self.steps += 1
-            mutable_domain[first] = [value]
-            if not self.ac3(local_assignment, mutable_domain, first):
-                if verbose:
-                    print("Assignment:")
-                    print_dicts(local_assignment)
-                    print("causes dead end, because:")
-                    print_dicts(mutable_domain)
-                # Dead end found
-                continue
-            else:
-                if verbose:
-                    print("Modified domains:")
-                    for k in mutable_domain.keys():
-                        print(k, ": from", domains[k], "to", mutable_domain[k])
-                # Continue in this direction
-                result = self.maintain_arc_consistency(mutable_domain, single, local_assignment, lcv, mcv)
-                if result is not None:
-                    # Result found
-                    if single:
-                        return result
-                    results.extend(result)
+    def maintain_arc_consistency(self, domains, single=False, assignment={}, lcv=False, mcv=False,
+                                 propagation="ac3", backjump=False, nogoods: Optional[NogoodStore] = None,
+                                 budget: Optional[Budget] = None, symmetry=False):
+        return self.solve("mac", domains, single, assignment, lcv, mcv, propagation, backjump, nogoods,
+                          budget=budget, symmetry=symmetry)
 
-        if single:
-            return None
-        if len(results) != 0:
-            return results
-        else:
-            return None
-
-    def backtracking_search(self, assignment={}, single=False, lcv=False, mcv=False):
-        results = []
-        if len(assignment) == len(self.variables):
-            if single:
-                return assignment
-            return [assignment]
-
-        unassigned: List[V] = [v for v in self.variables if v not in assignment]
-        if mcv:
-            unassigned = self.most_constrained_variable(self.domains, unassigned)
-        first: V = unassigned[0]
-        for value in self.domains[first] if not lcv else self.lcv(self.domains, assignment, first):
-            local_assignment = assignment.copy()
-            local_assignment[first] = value
-            self.steps += 1
-            if self.consistent(first, local_assignment):
-                result = self.backtracking_search(local_assignment, single=single, lcv=lcv, mcv=mcv)
-                if result is not None:
-                    if single:
-                        return result
-                    results.extend(result)
+    def backtracking_search(self, assignment={}, single=False, lcv=False, mcv=False, backjump=False,
+                            nogoods: Optional[NogoodStore] = None, budget: Optional[Budget] = None,
+                            symmetry=False):
+        return self.solve("bt", self.domains, single, assignment, lcv, mcv, backjump=backjump, nogoods=nogoods,
+                          budget=budget, symmetry=symmetry)
 
-        if single:
-            return None
-        if results is not None and len(results) != 0:
-            return results
-        else:
-            return None
-
-    def ac3(self, assignment, domains, first):
+    def ac3(self, assignment, store: DomainStore, first, propagation="ac3", incremental=False):
         unary = []
-        all_arcs = set()
-        arcs_queue = set()
-        # Find all arcs between variables from constraints
-        for v in self.constraints.keys():
-            if v == first or v not in assignment.keys():
-                for c in self.constraints[v]:
-                    if len(c.variables) > 1:
-                        arcs = list(itertools.permutations(c.variables, 2))
-                        for arc in arcs:
-                            new_arc = Arc(arc[0], arc[1], c)
-                            all_arcs.add(new_arc)
-                            arcs_queue.add(new_arc)
-                    else:
-                        unary.append(c)
+        # FIFO worklist of arcs, queued keeps every arc at most once in it
+        arcs_queue = deque()
+        if incremental:
+            # Domains were arc consistent before first was assigned,
+            # so only arcs of constraints with first can lose their supports
+            for c in self.constraints[first]:
+                arcs_queue.extend(self.constraint_arcs.get(c, []))
+        else:
+            active = set()
+            # Arcs of constraints with the new or unassigned variables
+            for v in self.variables:
+                if v == first or v not in assignment:
+                    unary.extend(self.unary[v])
+                    for arc in self.arcs_from[v]:
+                        if arc.constraint not in active:
+                            active.add(arc.constraint)
+                            arcs_queue.extend(self.constraint_arcs[arc.constraint])
+        queued = set(arcs_queue)
 
         # Check unary constraints
         for c in unary:
             v = c.variables[0]
             possible = []
-            for val in domains[v]:
+            for val in store[v]:
                 a = {v: val}
+                self.stats.checks += 1
                 if c.satisfied(a):
                     possible.append(val)
-            domains[v] = possible
-            if len(domains[v]) == 0:
+            if len(possible) != len(store[v]):
+                store.set(v, possible)
+            if len(possible) == 0:
                 # If out of values -> dead end
-                return False
+                return store.failed(v, c)
 
+        supports = self.supports if propagation == "ac2001" else None
         while len(arcs_queue) > 0:
-            arc = list(arcs_queue)[0]
-            arcs_queue.remove(arc)
-            if self.remove_inconsistent(arc, assignment, domains):
-                if len(domains[arc.x]) == 0:
+            arc = arcs_queue.popleft()
+            queued.remove(arc)
+            self.stats.revisions += 1
+            if self.remove_inconsistent(arc, assignment, store, supports):
+                if len(store.values[arc.xi]) == 0:
                     # If neighbour out of values -> dead end
-                    return False
-                for other_arc in all_arcs:
+                    return store.failed(arc.x, arc.constraint)
+                for other_arc in self.arcs_to[arc.x]:
                     # Add back all arcs related to modified domain
-                    if other_arc.x != arc.y and other_arc.y == arc.x:
-                        arcs_queue.add(other_arc)
+                    if other_arc.x != arc.y and other_arc not in queued:
+                        arcs_queue.append(other_arc)
+                        queued.add(other_arc)
         return True
 
-    def remove_inconsistent(self, arc: Arc, assignment, domains):
-        removed = False
-        localassignment = assignment.copy()
+    def remove_inconsistent(self, arc: Arc, assignment, store: DomainStore, supports=None):
+        # With supports (AC-2001 style) the last value of y which supported x=xv is tried first.
+        # It is checked again instead of trusted, because constraints can read the whole assignment.
+        values = store.values[arc.xi]
+        y_values = store.values[arc.yi]
+        # Values of x are removed because of the domain of y (and assigned variables the constraint reads)
+        reason = store.reasons.get(arc.y) if store.explaining else None
+        if arc.table is not None:
+            possible = arc.table.revise(values, y_values)
+            self.stats.checks += len(values)
+            if len(possible) != len(values):
+                store.replace(arc.xi, possible, reason)
+                return True
+            return False
+        if isinstance(arc.constraint, AllDifferent):
+            # Values of assigned variables are removed by their own arcs, so only x != y is left
+            possible = [xv for xv in values if arc.constraint.supported(xv, y_values)]
+            self.stats.checks += len(values)
+            if len(possible) != len(values):
+                store.replace(arc.xi, possible, reason)
+                return True
+            return False
+        if store.explaining:
+            reason = (reason or frozenset()).union(v for v in arc.constraint.variables if v in assignment)
+        possible = []
+        # Values are tried directly in the assignment and the previous state is restored afterwards
+        x_previous = assignment.get(arc.x, arc)
+        y_previous = assignment.get(arc.y, arc)
         # Check which values can be removed from domains
-        for xv in domains[arc.x]:
-            localassignment[arc.x] = xv
+        for xv in values:
+            assignment[arc.x] = xv
             satisfies = False
-            for yv in domains[arc.y]:
-                localassignment[arc.y] = yv
-                if arc.constraint.satisfied(localassignment):
-                    satisfies = True
-                    break
-                else:
-                    pass
+            tried = False
+            if supports is not None and (arc, xv) in supports:
+                residue = supports[(arc, xv)]
+                if residue in y_values:
+                    assignment[arc.y] = residue
+                    self.stats.checks += 1
+                    satisfies = arc.constraint.satisfied(assignment)
+                    tried = True
             if not satisfies:
-                domains[arc.x].remove(xv)
-                removed = True
-        return removed
-
-    def lcv(self, domains, assignment, variable):
-        # Least constraining values heuristic.
-        arcs_queue = []
-        for c in self.constraints[variable]:
-            if len([v for v in c.variables if v not in assignment]) > 1:
-                arcs = list(itertools.permutations(c.variables, 2))
-                arcs = [arc for arc in arcs if arc[0] == variable]
-                for arc in arcs:
-                    new_arc = Arc(arc[0], arc[1], c)
-                    arcs_queue.append(new_arc)
+                for yv in y_values:
+                    if tried and yv == residue:
+                        continue
+                    assignment[arc.y] = yv
+                    self.stats.checks += 1
+                    if arc.constraint.satisfied(assignment):
+                        satisfies = True
+                        if supports is not None:
+                            supports[(arc, xv)] = yv
+                        break
+            if satisfies:
+                possible.append(xv)
+        # arc marks a variable which was not assigned
+        for v, previous in ((arc.x, x_previous), (arc.y, y_previous)):
+            if previous is arc:
+                assignment.pop(v, None)
+            else:
+                assignment[v] = previous
+        if len(possible) != len(values):
+            store.replace(arc.xi, possible, reason)
+            return True
+        return False
+
+    def lcv(self, domains, assignment, variable, sample=None, rng: Optional[random.Random] = None):
+        # Least constraining values heuristic: values leaving the most supports in domains
+        # of unassigned neighbours go first. With sample only that many neighbour arcs are counted.
+        # With rng values with the same count come in random order.
+        arcs = [arc for arc in self.arcs_from[variable] if arc.y not in assignment]
+        if sample is not None and len(arcs) > sample:
+            step = len(arcs) / sample
+            arcs = [arcs[int(i * step)] for i in range(sample)]
 
         # Count how many possible values for neighbours and sort DESC
-        localassignment = assignment.copy()
-        possible_values = {}
-        for xv in domains[variable]:
-            localassignment[variable] = xv
-            possible_values[xv] = 0
-            for neighbour in arcs_queue:
-                for yv in domains[neighbour.y]:
-                    localassignment[neighbour.y] = yv
-                    if neighbour.constraint.satisfied(localassignment):
-                        possible_values[xv] += 1
-                localassignment.pop(neighbour.y, None)
+        values = domains[variable] if rng is None else rng.sample(domains[variable], len(domains[variable]))
+        possible_values = {xv: 0 for xv in values}
+        for arc in arcs:
+            counts = self.support_counts(arc, possible_values, domains[arc.y], assignment)
+            for xv in possible_values:
+                possible_values[xv] += counts[xv]
 
         new_possible = [k for k, v in sorted(possible_values.items(), key=lambda item: item[1], reverse=True)]
         return new_possible
 
+    def support_counts(self, arc: Arc[V, D], x_values, y_values, assignment: Dict[V, D]) -> Dict[D, int]:
+        # Number of values in y_values compatible with each value in x_values
+        if arc.table is not None:
+            return arc.table.counts(x_values, y_values)
+        # Binary constraints depend only on x and y, other assigned variables of the scope are part of the key
+        scope = tuple(assignment.get(v, arc) for v in arc.constraint.variables) \
+            if len(arc.constraint.variables) > 2 else ()
+        key = (arc, tuple(y_values), scope)
+        counts = self.lcv_cache.get(key)
+        if counts is None:
+            counts = self.lcv_cache[key] = {}
+            if len(self.lcv_cache) > self.lcv_cache_size:
+                self.lcv_cache.popitem(last=False)
+        else:
+            self.lcv_cache.move_to_end(key)
+        missing = [xv for xv in x_values if xv not in counts]
+        if len(missing) != 0:
+            saved = {v: assignment[v] for v in (arc.x, arc.y) if v in assignment}
+            for xv in missing:
+                assignment[arc.x] = xv
+                counts[xv] = 0
+                for yv in y_values:
+                    assignment[arc.y] = yv
+                    self.stats.checks += 1
+                    if arc.constraint.satisfied(assignment):
+                        counts[xv] += 1
+            for v in (arc.x, arc.y):
+                if v in saved:
+                    assignment[v] = saved[v]
+                else:
+                    assignment.pop(v, None)
+        return counts
+
     def most_constrained_variable(self, domain, unassigned):
         return sorted(unassigned, key=lambda item: len(domain[item]), reverse=False)
+
+    def add_interchangeable(self, values: List[D]):
+        # Declares that permuting values in a solution always gives a solution
+        self.interchangeable.append(list(values))
+        # Symmetry breaking uses them, so results cached before do not hold
+        self.fingerprinted = None
+
+    def detect_interchangeable(self) -> List[List[D]]:
+        # All values are interchangeable when every variable has the same domain and every
+        # constraint is value symmetric (graph coloring)
+        first = set(self.domains[self.variables[0]]) if len(self.variables) != 0 else set()
+        if any(set(self.domains[v]) != first for v in self.variables):
+            return []
+        if any(not c.value_symmetric for constraints in self.constraints.values() for c in constraints):
+            return []
+        return [list(self.domains[self.variables[0]])] if len(first) > 1 else []
+
+    def interchangeable_groups(self, domains=None, assignment=None) -> List[List[D]]:
+        # Declared groups, detected ones if none are declared. With domains only the groups which the
+        # domain of every variable (except those in assignment) holds whole or not at all,
+        # the others are broken by the domains.
+        groups = self.interchangeable or self.detect_interchangeable()
+        if domains is None:
+            return groups
+        kept = []
+        for group in groups:
+            values = set(group)
+            if all(len(values.intersection(domains[v])) in (0, len(values)) for v in self.variables
+                   if assignment is None or v not in assignment):
+                kept.append(group)
+        return kept
+
+    def symmetry_groups(self, domains=None, assignment=None) -> Dict[D, int]:
+        # Value -> index of its group, for interchangeable_groups
+        groups = self.interchangeable_groups(domains, assignment)
+        return {value: i for i, group in enumerate(groups) for value in group}
+
+    @staticmethod
+    def break_symmetry(values: List[D], symmetry: Dict[D, int], used: FrozenSet[D]) -> List[D]:
+        # Unused values of a group are interchangeable under the assignment, the first one is enough.
+        # Groups broken by the domains of the search are dropped in _prepare.
+        fresh = set()
+        result = []
+        for value in values:
+            group = symmetry.get(value)
+            if group is not None and value not in used:
+                if group in fresh:
+                    continue
+                fresh.add(group)
+            result.append(value)
+        return result
+
+    @staticmethod
+    def orbit(used, symmetry: Dict[D, int]) -> int:
+        # Number of ways to rename the used interchangeable values, k!/(k-m)! for every group
+        sizes = Counter(symmetry.values())
+        size = 1
+        for group, m in Counter(symmetry[v] for v in used if v in symmetry).items():
+            for k in range(sizes[group] - m + 1, sizes[group] + 1):
+                size *= k
+        return size
+
+    def orbit_size(self, solution: Dict[V, D], domains=None) -> int:
+        # Number of solutions which differ from solution by permuting interchangeable values,
+        # domains are those given to the search
+        return self.orbit(set(solution.values()), self.symmetry_groups(domains))
+
+    def expand(self, solution: Dict[V, D], domains=None):
+        # All solutions which differ from solution by permuting interchangeable values,
+        # domains are those given to the search.
+        # With a search started from a partial assignment, its values are not fixed here.
+        groups = self.interchangeable_groups(domains)
+        values = set(solution.values())
+        used = [[v for v in group if v in values] for group in groups]
+        images = [itertools.permutations(group, len(values)) for group, values in zip(groups, used)]
+        for mapping in itertools.product(*images):
+            rename = {old: new for values, image in zip(used, mapping) for old, new in zip(values, image)}
+            yield {variable: rename.get(value, value) for variable, value in solution.items()}
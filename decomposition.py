@@ -0,0 +1,325 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from csp import CSP, Constraint, SearchStats
+
+# End of values of a node in TreeSolver.solutions
+_done = object()
+
+
+def binary_only(csp: CSP, variables: List) -> bool:
+    # Constraints of variables have one or two variables
+    return all(len(c.variables) <= 2 for v in variables for c in csp.constraints[v])
+
+
+def scoped(csp: CSP, variables: List) -> bool:
+    # Constraints of variables read only their own variables, see Constraint.scoped
+    return all(c.scoped for v in variables for c in csp.constraints[v])
+
+
+def neighbours(csp: CSP, variables: List) -> Dict:
+    # Constraint graph of variables, only edges between them
+    inside = set(variables)
+    graph: Dict = {v: set() for v in variables}
+    for v in variables:
+        for constraint in csp.constraints[v]:
+            for w in constraint.variables:
+                if w != v and w in inside:
+                    graph[v].add(w)
+    return graph
+
+
+def is_tree(csp: CSP, variables: List) -> bool:
+    # Connected variables with binary constraints forming no cycle (several constraints of one pair are one edge)
+    if not binary_only(csp, variables):
+        return False
+    graph = neighbours(csp, variables)
+    return sum(len(ns) for ns in graph.values()) // 2 == len(variables) - 1
+
+
+def cycle_cutset(csp: CSP, variables: List) -> List:
+    # Variables whose removal leaves a forest. Greedy: vertices with at most one neighbour are
+    # peeled off, then the vertex with most neighbours left is cut, until nothing is left.
+    graph = neighbours(csp, variables)
+    index = {v: i for i, v in enumerate(variables)}
+    degree = {v: len(ns) for v, ns in graph.items()}
+    alive = set(variables)
+    cutset = []
+
+    def remove(v):
+        stack = [v]
+        while len(stack) != 0:
+            v = stack.pop()
+            if v not in alive:
+                continue
+            alive.discard(v)
+            for w in graph[v]:
+                if w in alive:
+                    degree[w] -= 1
+                    if degree[w] <= 1:
+                        stack.append(w)
+
+    for v in variables:
+        if degree[v] <= 1:
+            remove(v)
+    while len(alive) != 0:
+        v = max(alive, key=lambda v: (degree[v], -index[v]))
+        cutset.append(v)
+        remove(v)
+    return sorted(cutset, key=index.__getitem__)
+
+
+class TreeSolver:
+    # Tree shaped part of a CSP, solved without backtracking: directional arc consistency from
+    # the leaves to the root leaves every value of a parent a support in each child, so
+    # assigning from the root down never fails.
+    def __init__(self, csp: CSP, variables: List):
+        self.csp = csp
+        graph = neighbours(csp, variables)
+        # Breadth first order from the first variable, parent[i] comes before i
+        self.order = [variables[0]]
+        self.parent = [-1]
+        position = {variables[0]: 0}
+        for i in range(len(variables)):
+            for w in sorted(graph[self.order[i]], key=csp.ids.__getitem__):
+                if w not in position:
+                    position[w] = len(self.order)
+                    self.order.append(w)
+                    self.parent.append(i)
+        self.unary = [csp.unary[v] for v in self.order]
+        # Constraints between every variable and its parent
+        self.edges: List[List[Constraint]] = [[]]
+        for i in range(1, len(self.order)):
+            v, p = self.order[i], self.order[self.parent[i]]
+            self.edges.append([c for c in csp.constraints[v] if len(c.variables) == 2 and p in c.variables])
+
+    def compatible(self, i: int, value, parent_value) -> bool:
+        assignment = {self.order[i]: value, self.order[self.parent[i]]: parent_value}
+        for constraint in self.edges[i]:
+            self.csp.stats.checks += 1
+            if not constraint.satisfied(assignment):
+                return False
+        return True
+
+    def consistent(self, domains) -> Optional[List[List]]:
+        # Domains in order after node and directional arc consistency, None if some becomes empty
+        values = []
+        for v, unary in zip(self.order, self.unary):
+            values.append([x for x in domains[v] if all(self._check(c, {v: x}) for c in unary)])
+        for i in range(len(self.order) - 1, 0, -1):
+            p = self.parent[i]
+            values[p] = [pv for pv in values[p] if any(self.compatible(i, cv, pv) for cv in values[i])]
+        if any(len(vs) == 0 for vs in values):
+            return None
+        return values
+
+    def _check(self, constraint: Constraint, assignment) -> bool:
+        self.csp.stats.checks += 1
+        return constraint.satisfied(assignment)
+
+    def solutions(self, domains) -> Iterator[Dict]:
+        values = self.consistent(domains)
+        if values is None:
+            return
+        n = len(self.order)
+        # Values of child i compatible with a value of its parent
+        candidates: Dict[Tuple[int, object], List] = {}
+        current = [None] * n
+        stack = [iter(values[0])]
+        while len(stack) != 0:
+            value = next(stack[-1], _done)
+            if value is _done:
+                stack.pop()
+                continue
+            i = len(stack) - 1
+            current[i] = value
+            if i + 1 == n:
+                yield dict(zip(self.order, current))
+                continue
+            key = (i + 1, current[self.parent[i + 1]])
+            if key not in candidates:
+                candidates[key] = [cv for cv in values[i + 1] if self.compatible(i + 1, cv, key[1])]
+            stack.append(iter(candidates[key]))
+
+
+class CutsetSolver:
+    # Near tree part of a CSP: every consistent assignment of the cycle cutset is searched, values of
+    # the other variables incompatible with it are removed, and the forest left is solved by TreeSolvers.
+    def __init__(self, csp: CSP, variables: List, cutset: List, method="fc", **kwargs):
+        self.csp = csp
+        self.cutset = cutset
+        self.method = method
+        self.kwargs = kwargs
+        self.cut = csp.subproblem(cutset)
+        self.cut.stats = csp.stats
+        inside = set(cutset)
+        rest = [v for v in variables if v not in inside]
+        forest = csp.subproblem(rest)
+        forest.stats = csp.stats
+        self.trees = [TreeSolver(forest, part) for part in forest.components()]
+        # Constraints between every other variable and the cutset
+        self.links = {v: [c for c in csp.constraints[v] if len(c.variables) == 2 and any(w in inside
+                                                                                        for w in c.variables)]
+                      for v in rest}
+
+    def solutions(self, domains) -> Iterator[Dict]:
+        cut_domains = {v: domains[v] for v in self.cutset}
+        for cut in self.cut.iter_solutions(self.method, cut_domains, **self.kwargs):
+            rest_domains = {}
+            for v, links in self.links.items():
+                values = domains[v]
+                for constraint in links:
+                    values = [x for x in values if self._check(constraint, cut, v, x)]
+                rest_domains[v] = values
+            trees = [tree.solutions(rest_domains) for tree in self.trees]
+            for solution in lazy_product(trees):
+                solution.update(cut)
+                yield solution
+
+    def _check(self, constraint: Constraint, cut, v, value) -> bool:
+        self.csp.stats.checks += 1
+        cut[v] = value
+        try:
+            return constraint.satisfied(cut)
+        finally:
+            del cut[v]
+
+
+def lazy_product(parts: List[Iterator[Dict]]) -> Iterator[Dict]:
+    # Merged solutions of every combination of solutions of parts, like itertools.product, but a
+    # solution of a part is only taken when it is needed and kept for the next combinations
+    caches: List[List[Dict]] = [[] for _ in parts]
+
+    def get(i, k) -> Optional[Dict]:
+        while len(caches[i]) <= k:
+            solution = next(parts[i], None)
+            if solution is None:
+                return None
+            caches[i].append(solution)
+        return caches[i][k]
+
+    if any(get(i, 0) is None for i in range(len(parts))):
+        return
+    indexes = [0] * len(parts)
+    while True:
+        solution = {}
+        for i, k in enumerate(indexes):
+            solution.update(caches[i][k])
+        yield solution
+        # Next combination, the last part changes fastest
+        i = len(parts) - 1
+        while i >= 0:
+            indexes[i] += 1
+            if get(i, indexes[i]) is not None:
+                break
+            indexes[i] = 0
+            i -= 1
+        if i < 0:
+            return
+
+
+def plan(csp: CSP, cutset=True, max_cutset=8) -> List[Tuple[str, List, List]]:
+    # (kind, variables, cutset) for every connected component: "tree", "cutset" or "search".
+    # Trees and cutsets check constraints on their parts of the assignment only, so components
+    # with unscoped constraints are searched.
+    parts = []
+    for variables in csp.components():
+        if not scoped(csp, variables):
+            parts.append(("search", variables, []))
+            continue
+        if is_tree(csp, variables):
+            parts.append(("tree", variables, []))
+            continue
+        if cutset and binary_only(csp, variables):
+            cut = cycle_cutset(csp, variables)
+            if len(cut) <= max_cutset:
+                parts.append(("cutset", variables, cut))
+                continue
+        parts.append(("search", variables, []))
+    return parts
+
+
+def _solve_part(sub: CSP, method, domains, single, kwargs) -> Tuple[List[Dict], SearchStats]:
+    solutions = list(sub.iter_solutions(method, domains, limit=1 if single else None, **kwargs))
+    return solutions, sub.stats
+
+
+def decomposed_iter_solutions(csp: CSP, method="fc", domains=None, limit=None, cutset=True, max_cutset=8,
+                              workers: Optional[int] = None, **kwargs) -> Iterator[Dict]:
+    # Solutions of csp combined from solutions of its connected components. Trees are solved
+    # with directional arc consistency, near trees with a cycle cutset of at most max_cutset
+    # variables (when cutset), the rest by csp search with method and kwargs.
+    # With workers the searched components are solved in that many processes first, all their
+    # solutions at once (one if limit is 1). Otherwise solutions of every part are found lazily.
+    if domains is None:
+        domains = csp.domains
+    # Searched parts add their solutions to the shared stats, only combined solutions are counted
+    counted = csp.stats.solutions
+    parts: List[Iterator[Dict]] = []
+    searched: Dict[int, CSP] = {}
+    for kind, variables, cut in plan(csp, cutset, max_cutset):
+        part_domains = {v: domains[v] for v in variables}
+        if kind == "tree":
+            parts.append(TreeSolver(csp, variables).solutions(part_domains))
+        elif kind == "cutset":
+            parts.append(CutsetSolver(csp, variables, cut, method, **kwargs).solutions(part_domains))
+        else:
+            sub = csp.subproblem(variables)
+            if workers is None:
+                sub.stats = csp.stats
+                parts.append(sub.iter_solutions(method, part_domains, **kwargs))
+            else:
+                searched[len(parts)] = sub
+                parts.append(iter(()))
+    if len(searched) != 0:
+        single = limit == 1
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {i: executor.submit(_solve_part, sub, method, {v: domains[v] for v in sub.variables},
+                                          single, kwargs) for i, sub in searched.items()}
+            for i, future in futures.items():
+                solutions, stats = future.result()
+                csp.stats.add(stats)
+                parts[i] = iter(solutions)
+    if limit == 0:
+        return
+    found = 0
+    for solution in lazy_product(parts):
+        found += 1
+        csp.stats.solutions = counted + found
+        yield solution
+        if limit is not None and found >= limit:
+            return
+
+
+def decomposed_solve(csp: CSP, method="fc", domains=None, single=False, cutset=True, max_cutset=8,
+                     workers: Optional[int] = None, **kwargs):
+    solutions = decomposed_iter_solutions(csp, method, domains, 1 if single else None, cutset, max_cutset, workers,
+                                          **kwargs)
+    if single:
+        return next(solutions, None)
+    results: List[Dict] = list(solutions)
+    if len(results) != 0:
+        return results
+    else:
+        return None
+
+
+if __name__ == "__main__":
+    import time
+    from benchmark import near_tree
+    from csp import Budget
+
+    # Unsolvable near trees: DAC finds it at once, search only after trying many assignments
+    for n, extra in ((300, 0), (1000, 5)):
+        csp = near_tree(n, 5, 0.6, extra, seed=0)
+        print("Near tree:", n, "variables", extra, "extra edges", [(kind, len(cut)) for kind, _, cut in plan(csp)])
+        start_time = time.time()
+        solution = decomposed_solve(csp, "fc", single=True, ordering="mrv")
+        print("Decomposed:", solution is not None, round((time.time() - start_time) * 1000), "ms",
+              "Steps:", csp.steps, "Checks:", csp.checks)
+        csp = near_tree(n, 5, 0.6, extra, seed=0)
+        budget = Budget(seconds=10)
+        start_time = time.time()
+        solution = csp.solve("fc", single=True, ordering="mrv", budget=budget)
+        print("Search:", solution is not None, round((time.time() - start_time) * 1000), "ms",
+              "Steps:", csp.steps, "Checks:", csp.checks, "Stopped:", budget.reason)
@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Optional, Tuple
+
+from csp import CSP, Budget
+from restarts import restart_solve
+
+# Configurations of portfolio_solve: keyword arguments of CSP.solve, with "restarts" (and optionally
+# scale, factor and learn) of restart_solve instead
+PORTFOLIO = [
+    {"method": "mac", "ordering": "dom/wdeg"},
+    {"method": "mac", "ordering": "dom/wdeg", "restarts": "luby"},
+    {"method": "fc", "ordering": "mrv-deg"},
+    {"method": "fc", "ordering": "mrv", "restarts": "luby"},
+    {"method": "fc", "ordering": "dom/wdeg", "restarts": "geometric"},
+    {"method": "mac", "ordering": "mrv", "lcv": True},
+    {"method": "fc", "ordering": "dom/deg", "backjump": True},
+    {"method": "bt", "ordering": "mrv", "backjump": True},
+]
+
+# State of a worker process, set once by the pool initializer
+_worker_csp: Optional[CSP] = None
+
+
+def _init_worker(csp: CSP, stop):
+    global _worker_csp
+    _worker_csp = csp
+    _worker_csp.interrupt = stop
+
+
+def _solve_subproblem(method, domains, assignment, single, lcv, mcv, propagation, seconds=None, nodes=None):
+    csp = _worker_csp
+    csp.steps = 0
+    csp.checks = 0
+    budget = Budget(seconds, nodes) if seconds is not None or nodes is not None else None
+    solutions = list(csp.iter_solutions(method, domains, assignment, lcv, mcv, 1 if single else None, propagation,
+                                        budget=budget))
+    return solutions, csp.steps, csp.checks
+
+
+def _run_configuration(configuration: Dict, seed, seconds=None, nodes=None):
+    # (solution, reason, stats), reason is None when the search ended by itself
+    csp = _worker_csp
+    csp.stats.reset()
+    kwargs = dict(configuration)
+    strategy = kwargs.pop("restarts", None)
+    budget = Budget(seconds, nodes)
+    if strategy is None:
+        solution = csp.solve(single=True, budget=budget, seed=seed, **kwargs)
+    else:
+        solution = restart_solve(csp, strategy=strategy, seed=seed, budget=budget, **kwargs)
+    reason = None
+    if solution is None:
+        reason = budget.reason or ("cancelled" if csp.interrupt.is_set() else None)
+    return solution, reason, csp.stats
+
+
+def portfolio_solve(csp: CSP, configurations: Optional[List[Dict]] = None, workers=None, seed=0,
+                    budget: Optional[Budget] = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    # Searches for one solution with every configuration (PORTFOLIO by default) in its own process,
+    # with random tie-breaking seeded by seed and its position. The first one to find a solution or to
+    # prove there is none wins, the others are cancelled. Returns (solution, winning configuration),
+    # the configuration is None when every search was stopped by the budget.
+    # Stats of all finished searches are added to csp.stats.
+    configurations = PORTFOLIO if configurations is None else configurations
+    workers = min(len(configurations), workers or os.cpu_count() or 1)
+    context = multiprocessing.get_context()
+    stop = context.Event()
+    if budget is not None:
+        budget.start(csp.stats)
+    executor = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(csp, stop))
+    running = {}
+    reason = None
+    try:
+        for i, configuration in enumerate(configurations):
+            # Configurations waiting for a worker get the same limits, the budget is checked here as well
+            limits = () if budget is None else (budget.remaining_seconds, budget.nodes)
+            running[executor.submit(_run_configuration, configuration, seed + i, *limits)] = configuration
+        while len(running) != 0:
+            if budget is not None and budget.exhausted(csp.stats):
+                return None, None
+            done, _ = wait(running, timeout=None if budget is None else 0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                configuration = running.pop(future)
+                solution, reason, stats = future.result()
+                csp.stats.add(stats)
+                if reason is None:
+                    return solution, configuration
+        if budget is not None:
+            budget.reason = reason
+        return None, None
+    finally:
+        # The other searches stop at their next node
+        stop.set()
+        for future in running:
+            future.cancel()
+        executor.shutdown(cancel_futures=True)
+
+
+def parallel_iter_solutions(csp: CSP, method="bt", single=False, depth=2, workers=None, lcv=False, mcv=False,
+                            propagation="ac3", budget: Optional[Budget] = None):
+    # The first depth variables are branched on here (most constrained first), every subtree
+    # below them is searched by a worker process. Solutions come in order of finished subtrees.
+    # Steps and checks of the workers are added to csp.steps and csp.checks.
+    # The budget is checked here while waiting for workers, which get the time and nodes left.
+    # Running workers do not share their nodes, so together they can use up to that many each.
+    # The memory limit applies to this process only.
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context()
+    stop = context.Event()
+    subproblems = csp.iter_subproblems(method, depth, lcv=lcv, mcv=True, propagation=propagation, budget=budget)
+    executor = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(csp, stop))
+    running = set()
+    try:
+        while True:
+            # Keep a bounded number of subtrees queued, so splitting is as lazy as the search
+            if budget is not None and budget.exhausted(csp.stats):
+                return
+            for assignment, domains in subproblems:
+                if budget is None:
+                    limits = ()
+                else:
+                    nodes = None if budget.nodes is None else budget.nodes - (csp.steps - budget.first_step)
+                    limits = (budget.remaining_seconds, nodes)
+                running.add(executor.submit(_solve_subproblem, method, domains, assignment, single, lcv, mcv,
+                                            propagation, *limits))
+                if len(running) >= 2 * workers:
+                    break
+            if len(running) == 0:
+                return
+            # Polling, so a cancelled or timed out budget is noticed while workers run
+            done, running = wait(running, timeout=None if budget is None else 0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                solutions, steps, checks = future.result()
+                csp.steps += steps
+                csp.checks += checks
+                for solution in solutions:
+                    yield solution
+                    if single:
+                        return
+    finally:
+        # Workers in the middle of a subtree stop at their next node
+        stop.set()
+        for future in running:
+            future.cancel()
+        for future in running:
+            if not future.cancelled():
+                _, steps, checks = future.result()
+                csp.steps += steps
+                csp.checks += checks
+        executor.shutdown(cancel_futures=True)
+        subproblems.close()
+
+
+def parallel_solve(csp: CSP, method="bt", single=False, depth=2, workers=None, lcv=False, mcv=False,
+                   propagation="ac3", budget: Optional[Budget] = None):
+    solutions = parallel_iter_solutions(csp, method, single, depth, workers, lcv, mcv, propagation, budget)
+    try:
+        if single:
+            return next(solutions, None)
+        results: List[Dict] = list(solutions)
+    finally:
+        solutions.close()
+    if len(results) != 0:
+        return results
+    else:
+        return None
+
+
+def speedup(make_csp, method="bt", single=False, depth=2, workers_list=(1, 2, 4, 8, 16, 32), **kwargs):
+    # Wall time of parallel_solve for each number of workers, relative to the sequential search
+    csp = make_csp()
+    start_time = time.time()
+    csp.solve(method, single=single, **kwargs)
+    sequential = time.time() - start_time
+    print("Sequential:", round(sequential * 1000), "ms", "Steps:", csp.steps)
+    for workers in workers_list:
+        csp = make_csp()
+        start_time = time.time()
+        parallel_solve(csp, method, single, depth, workers, **kwargs)
+        elapsed = time.time() - start_time
+        print("Workers:", workers, round(elapsed * 1000), "ms", "Speedup:", round(sequential / elapsed, 2),
+              "Steps:", csp.steps)
+
+
+if __name__ == "__main__":
+    from Grid import Grid
+    from GridColoringProblem import GridColoringConstraint
+
+    def grid_coloring():
+        grid = Grid(40, 40)
+        grid.random_points(12)
+        grid.generate_connections()
+        domains = {point: ["red", "green", "blue", "yellow"] for point in grid.points}
+        problem = CSP(grid.points, domains)
+        for connection in grid.connections:
+            problem.add_constraint(GridColoringConstraint(connection[0], connection[1]))
+        return problem
+
+    print("CPUs:", os.cpu_count())
+    speedup(grid_coloring, "fc", single=False, depth=3)
+
+    from benchmark import random_binary
+
+    for seed in range(5):
+        csp = random_binary(50, 6, 0.2, 0.28, seed)
+        start_time = time.time()
+        solution, configuration = portfolio_solve(csp, budget=Budget(30))
+        print("Portfolio:", solution is not None, round((time.time() - start_time) * 1000), "ms",
+              "Winner:", configuration, "Steps:", csp.steps)
@@ -0,0 +1,157 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from csp import CSP, DomainStore, SearchStats
+
+
+class Preprocessing:
+    # What preprocess removed: values of the domains (by stage) and unary constraints
+    def __init__(self):
+        self.values = 0
+        self.node = 0
+        self.arc = 0
+        self.singleton = 0
+        self.unary = 0
+        self.checks = 0
+        self.time = 0.0
+        # False when some domain became empty, the problem has no solution then
+        self.consistent = True
+
+    @property
+    def removed(self) -> int:
+        return self.node + self.arc + self.singleton
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(vars(self), removed=self.removed)
+
+    def __str__(self):
+        share = self.removed / self.values if self.values != 0 else 0.0
+        return (f"Removed: {self.removed} of {self.values} values ({share:.1%}), node: {self.node}, "
+                f"arc: {self.arc}, singleton: {self.singleton}, unary constraints: {self.unary}, "
+                f"checks: {self.checks}, time: {round(self.time * 1000, 3)} ms"
+                + ("" if self.consistent else ", inconsistent"))
+
+
+def size(domains, variables: List) -> int:
+    return sum(len(domains[v]) for v in variables)
+
+
+def node_consistency(csp: CSP, domains=None) -> Dict:
+    # Domains without the values which violate a unary constraint. Constraints which are not scoped
+    # can depend on other variables, they are left to the search.
+    if domains is None:
+        domains = csp.domains
+    consistent = {}
+    for v in csp.variables:
+        values = list(domains[v])
+        for constraint in csp.unary[v]:
+            if not constraint.scoped:
+                continue
+            csp.stats.checks += len(values)
+            values = [x for x in values if constraint.satisfied({v: x})]
+        consistent[v] = values
+    return consistent
+
+
+def arc_consistency(csp: CSP, store: DomainStore, propagation="ac3") -> bool:
+    # Makes domains in store arc consistent, False if one of them becomes empty
+    if any(len(values) == 0 for values in store.values):
+        return False
+    if len(csp.variables) == 0:
+        return True
+    # Nothing is assigned, so every arc is revised whichever variable is given as the new one
+    return csp.ac3({}, store, csp.variables[0], propagation)
+
+
+def singleton_arc_consistency(csp: CSP, store: DomainStore, propagation="ac3") -> bool:
+    # SAC-1: a value is removed when assigning it makes the domains arc inconsistent,
+    # until no value is removed in a whole round. Domains in store must be arc consistent.
+    changed = True
+    while changed:
+        changed = False
+        for v in csp.variables:
+            values = store[v]
+            kept = []
+            for value in values:
+                token = store.mark()
+                store.assign(v, value)
+                # Only arcs of constraints with v can lose their supports
+                if csp.ac3({v: value}, store, v, propagation, incremental=True):
+                    kept.append(value)
+                store.undo(token)
+            if len(kept) != len(values):
+                changed = True
+                store.set(v, kept)
+                if len(kept) == 0 or not arc_consistency(csp, store, propagation):
+                    return False
+    return True
+
+
+def preprocess(csp: CSP, singleton=False, propagation="ac3", domains=None) -> Tuple[CSP, Preprocessing]:
+    # Runs once before search: node consistency, arc consistency and with singleton also singleton
+    # arc consistency. Returns a CSP with the reduced domains and without scoped unary constraints,
+    # so no search node checks them again, and what was removed. It has the same solutions as csp.
+    report = Preprocessing()
+    checks = csp.stats.checks
+    start_time = time.perf_counter()
+    if domains is None:
+        domains = csp.domains
+    report.values = size(domains, csp.variables)
+    report.unary = sum(c.scoped for v in csp.variables for c in csp.unary[v])
+    reduced = node_consistency(csp, domains)
+    report.node = report.values - size(reduced, csp.variables)
+    problem = csp.subproblem(csp.variables, reduced, unary=False)
+    problem.stats = csp.stats
+    store = DomainStore(reduced, ids=problem.ids)
+    left = size(reduced, csp.variables)
+    report.consistent = arc_consistency(problem, store, propagation)
+    report.arc = left - size(store, csp.variables)
+    if singleton and report.consistent:
+        left = size(store, csp.variables)
+        report.consistent = singleton_arc_consistency(problem, store, propagation)
+        report.singleton = left - size(store, csp.variables)
+    for v, values in store.items():
+        problem.domains[v] = values
+    problem.stats = SearchStats()
+    report.checks = csp.stats.checks - checks
+    report.time = time.perf_counter() - start_time
+    return problem, report
+
+
+def compare(csp: CSP, method="mac", singleton=False, propagation="ac3", single=False,
+            **kwargs) -> Optional[Dict[str, float]]:
+    # Search time without and with preprocessing (its time included), None if the results differ
+    original = csp.subproblem(csp.variables)
+    start_time = time.perf_counter()
+    expected = original.solve(method, single=single, propagation=propagation, **kwargs)
+    plain = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    problem, report = preprocess(csp, singleton, propagation)
+    found = problem.solve(method, single=single, propagation=propagation, **kwargs)
+    reduced = time.perf_counter() - start_time
+    if single:
+        same = (expected is None) == (found is None)
+    else:
+        key = lambda solutions: sorted(tuple(s[v] for v in csp.variables) for s in solutions or [])
+        same = key(expected) == key(found)
+    if not same:
+        return None
+    return {"plain_ms": round(plain * 1000, 3), "preprocessed_ms": round(reduced * 1000, 3),
+            "preprocess_ms": round(report.time * 1000, 3), "saved_ms": round((plain - reduced) * 1000, 3),
+            "removed": report.removed, "values": report.values}
+
+
+if __name__ == "__main__":
+    from benchmark import einstein, random_binary
+
+    for seed in range(3):
+        csp = einstein(seed=seed)
+        for singleton in (False, True):
+            problem, report = preprocess(csp, singleton)
+            print("Einstein", seed, "SAC" if singleton else "AC", report)
+        for method in CSP.methods:
+            print("Einstein", seed, method, compare(csp, method, single=True, ordering="mrv"))
+    csp = random_binary(25, 6, 0.3, 0.35, seed=1)
+    problem, report = preprocess(csp, True)
+    print("Random binary SAC", report)
+    print("Random binary fc", compare(csp, "fc", singleton=True, single=True, ordering="mrv"))
@@ -0,0 +1,81 @@
+import cProfile
+import marshal
+import signal
+import threading
+from typing import Dict, Tuple
+
+# pstats key of a function: (file name, first line, name)
+Function = Tuple[str, int, str]
+
+
+class SamplingProfiler:
+    # Every interval seconds of CPU time the stack of the main thread is recorded.
+    # Costs almost nothing per call, unlike cProfile, but times are estimates from samples.
+    # dump_stats writes a pstats file: "calls" are numbers of samples, times are samples * interval.
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = 0
+        # function -> [samples on stack, seconds at the top, seconds on stack, {caller: [samples, seconds...]}]
+        self.functions: Dict[Function, list] = {}
+        self.previous = None
+        self.running = False
+        self.active = False
+
+    def enable(self):
+        # The timer keeps running while disabled, restarting it would lose periods shorter than interval
+        self.active = True
+        if not self.running:
+            self.previous = signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+            self.running = True
+
+    def disable(self):
+        self.active = False
+
+    def stop(self):
+        self.active = False
+        if self.running:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self.previous)
+            self.running = False
+
+    def sample(self, signum, frame):
+        if not self.active:
+            return
+        self.samples += 1
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        seen = set()
+        for depth, function in enumerate(stack):
+            entry = self.functions.setdefault(function, [0, 0.0, 0.0, {}])
+            if depth == 0:
+                entry[1] += self.interval
+            if function in seen:
+                # Recursive frames count once per sample
+                continue
+            seen.add(function)
+            entry[0] += 1
+            entry[2] += self.interval
+            if depth + 1 < len(stack):
+                caller = entry[3].setdefault(stack[depth + 1], [0, 0, 0.0, 0.0])
+                caller[0] += 1
+                caller[1] += 1
+                caller[2] += self.interval if depth == 0 else 0.0
+                caller[3] += self.interval
+
+    def dump_stats(self, path):
+        self.stop()
+        stats = {function: (samples, samples, top, total, {caller: tuple(value) for caller, value in callers.items()})
+                 for function, (samples, top, total, callers) in self.functions.items()}
+        with open(path, "wb") as file:
+            marshal.dump(stats, file)
+
+
+def make_profiler(interval=0.001):
+    # Sampling profiler when interval is given and signals can be used here, cProfile otherwise
+    if interval is not None and hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread():
+        return SamplingProfiler(interval)
+    return cProfile.Profile()
@@ -0,0 +1,105 @@
+import random
+from typing import Dict, Iterator, Optional
+
+from csp import CSP, Budget, NogoodStore
+
+
+def luby() -> Iterator[int]:
+    # 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ... (Luby, Sinclair and Zuckerman)
+    u, v = 1, 1
+    while True:
+        yield v
+        if u & -u == v:
+            u += 1
+            v = 1
+        else:
+            v *= 2
+
+
+def geometric(factor=1.5) -> Iterator[float]:
+    # 1, factor, factor^2, ...
+    term = 1.0
+    while True:
+        yield term
+        term *= factor
+
+
+strategies = ("luby", "geometric")
+
+
+def cutoffs(strategy="luby", scale=100, factor=1.5) -> Iterator[int]:
+    # Assignments allowed to each run of a restart strategy
+    if strategy not in strategies:
+        raise ValueError(f"Unknown restart strategy: {strategy}")
+    terms = luby() if strategy == "luby" else geometric(factor)
+    for term in terms:
+        yield max(1, round(scale * term))
+
+
+def restart_solve(csp: CSP, method="mac", strategy="luby", scale=100, factor=1.5, seed=0, learn=True,
+                  nogoods: Optional[NogoodStore] = None, budget: Optional[Budget] = None, **kwargs) -> Optional[Dict]:
+    # First solution found by a series of searches with random tie-breaking, each stopped after the next
+    # cutoff of strategy (in assignments) and started again with the next seed. Cutoffs grow without
+    # bound, so a problem without solutions is still proven so by some run.
+    # With learn the nogoods of all runs are kept in one store (learned from searched subtrees only,
+    # so they hold for any run). dom/wdeg keeps its weights across runs in csp.weights anyway.
+    # When budget runs out None is returned and budget.reason tells why. kwargs are those of CSP.solve.
+    if learn and nogoods is None:
+        nogoods = NogoodStore()
+    if budget is not None:
+        budget.start(csp.stats)
+    rng = random.Random(seed)
+    for cutoff in cutoffs(strategy, scale, factor):
+        nodes = cutoff
+        if budget is not None and budget.nodes is not None:
+            nodes = min(cutoff, budget.nodes - (csp.stats.steps - budget.first_step))
+        run = Budget(nodes=nodes) if budget is None else \
+            Budget(budget.remaining_seconds, nodes, budget.memory_mb, budget.cancel, budget.check_every)
+        solution = csp.solve(method, single=True, nogoods=nogoods if learn else None, budget=run,
+                             seed=rng.getrandbits(32), **kwargs)
+        if budget is not None and len(run.best) > len(budget.best):
+            budget.best = run.best
+        if solution is not None or csp.interrupt is not None and csp.interrupt.is_set():
+            return solution
+        if run.reason is None:
+            # Searched to the end without a solution
+            return None
+        if run.reason != "nodes" or nodes < cutoff:
+            # Stopped by a limit of budget
+            budget.reason = run.reason
+            return None
+        csp.stats.restarts += 1
+    return None
+
+
+if __name__ == "__main__":
+    import statistics
+    import time
+    from benchmark import random_binary
+
+    # Times of a deterministic search and of restarts on instances near the phase transition,
+    # the slowest ones show the tail
+    configurations = (
+        ("fc mrv", lambda csp, budget: csp.solve("fc", single=True, ordering="mrv", budget=budget)),
+        ("fc mrv luby", lambda csp, budget: restart_solve(csp, "fc", "luby", ordering="mrv", budget=budget)),
+        ("fc mrv geometric", lambda csp, budget: restart_solve(csp, "fc", "geometric", ordering="mrv",
+                                                               budget=budget)),
+        ("mac dom/wdeg", lambda csp, budget: csp.solve("mac", single=True, ordering="dom/wdeg", budget=budget)),
+        ("mac dom/wdeg luby", lambda csp, budget: restart_solve(csp, "mac", "luby", ordering="dom/wdeg",
+                                                                budget=budget)),
+    )
+    for name, solve in configurations:
+        times = []
+        solved = 0
+        stopped = 0
+        restarts = 0
+        for seed in range(10):
+            csp = random_binary(40, 6, 0.2, 0.3, seed)
+            budget = Budget(5)
+            start_time = time.perf_counter()
+            solved += solve(csp, budget) is not None
+            times.append((time.perf_counter() - start_time) * 1000)
+            stopped += budget.reason is not None
+            restarts += csp.stats.restarts
+        print(name, "Median:", round(statistics.median(times), 1), "ms", "Max:", round(max(times), 1), "ms",
+              "Solved:", solved, "Stopped:", stopped, "Restarts:", restarts)
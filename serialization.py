@@ -0,0 +1,235 @@
+import json
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from csp import CSP, AllDifferent
+from tables import TableConstraint, compile_tables, constraint_table
+
+# Instance files are NumPy .npz archives:
+#   header           JSON: format, labels (str of every variable), values (all values of all domains),
+#                    interchangeable (groups of value indexes)
+#   domain_offsets   n + 1 offsets into domain_values, domain of variable i is domain_values[offsets[i]:offsets[i + 1]]
+#   domain_values    indexes into values, unary constraints already applied
+#   binary_scopes    (m, 2) variable ids of binary constraints
+#   binary_offsets   m + 1 bit offsets into binary_bits, each table row-major over the two domains
+#   binary_bits      all tables, packed 8 to a byte
+#   binary_symmetric Constraint.value_symmetric of every binary constraint
+#   alldiff_offsets, alldiff_variables  scopes of AllDifferent constraints
+#
+# Solution files are a header and rows of value indexes, one row per solution in variable order:
+#   8 bytes magic, 8 bytes length of the JSON header (labels, values, dtype), JSON,
+#   padding to a multiple of 64 bytes, rows. They are read with np.memmap.
+FORMAT = 1
+SOLUTIONS_MAGIC = b"CSPSOL1\0"
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    raise ValueError(f"Value {value!r} can not be stored, values must be str, int, float, bool or None")
+
+
+def value_list(csp: CSP) -> Tuple[List, Dict]:
+    # Values of all domains in order of first appearance and their indexes
+    values = []
+    index = {}
+    for variable in csp.variables:
+        for value in csp.domains[variable]:
+            if value not in index:
+                index[value] = len(values)
+                values.append(_json_value(value))
+    return values, index
+
+
+def save_instance(path, csp: CSP):
+    # Binary constraints are stored as tables over the domains, so they must depend on their two variables only.
+    # Other constraints than unary, binary and AllDifferent can not be stored, nor those which are not scoped.
+    for variable in csp.variables:
+        for constraint in csp.constraints[variable]:
+            if not constraint.scoped:
+                raise ValueError(f"{type(constraint).__qualname__} reads variables outside its scope "
+                                 "and can not be stored")
+    values, index = value_list(csp)
+    domains = []
+    for variable in csp.variables:
+        domain = [value for value in csp.domains[variable]
+                  if all(c.satisfied({variable: value}) for c in csp.unary[variable])]
+        domains.append(domain)
+    offsets = np.cumsum([0] + [len(d) for d in domains], dtype=np.int64)
+    domain_values = np.array([index[value] for d in domains for value in d], dtype=np.int32)
+    ids = csp.ids
+    scopes, tables, symmetric, alldiff = [], [], [], []
+    for constraint in csp.constraint_arcs:
+        if isinstance(constraint, AllDifferent):
+            alldiff.append([ids[v] for v in constraint.variables])
+        elif len(constraint.variables) == 2:
+            x, y = constraint.variables
+            scopes.append((ids[x], ids[y]))
+            tables.append(constraint_table(constraint, domains[ids[x]], domains[ids[y]]).ravel())
+            symmetric.append(constraint.value_symmetric)
+        else:
+            raise ValueError(f"{type(constraint).__qualname__} over {len(constraint.variables)} variables "
+                             f"can not be stored")
+    bits = np.concatenate(tables) if len(tables) != 0 else np.zeros(0, dtype=bool)
+    header = {"format": FORMAT, "labels": [str(v) for v in csp.variables], "values": values,
+              "interchangeable": [[index[v] for v in group] for group in csp.interchangeable]}
+    np.savez_compressed(
+        path,
+        header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+        domain_offsets=offsets,
+        domain_values=domain_values,
+        binary_scopes=np.array(scopes, dtype=np.int32).reshape(-1, 2),
+        binary_offsets=np.cumsum([0] + [len(t) for t in tables], dtype=np.int64),
+        binary_bits=np.packbits(bits, bitorder="little"),
+        binary_symmetric=np.array(symmetric, dtype=bool),
+        alldiff_offsets=np.cumsum([0] + [len(s) for s in alldiff], dtype=np.int64),
+        alldiff_variables=np.array([v for s in alldiff for v in s], dtype=np.int32),
+    )
+
+
+def load_instance(path) -> Tuple[CSP, List[str]]:
+    # CSP over variables 0..n-1 with TableConstraints (tables compiled) and the labels of the variables
+    with np.load(path) as data:
+        header = json.loads(data["header"].tobytes().decode())
+        if header["format"] != FORMAT:
+            raise ValueError(f"Unknown instance format {header['format']}")
+        values = header["values"]
+        labels = header["labels"]
+        offsets = data["domain_offsets"]
+        domain_values = data["domain_values"]
+        domains = {i: [values[j] for j in domain_values[offsets[i]:offsets[i + 1]]] for i in range(len(labels))}
+        csp: CSP = CSP(list(range(len(labels))), domains)
+        binary_offsets = data["binary_offsets"]
+        bits = np.unpackbits(data["binary_bits"], count=int(binary_offsets[-1]), bitorder="little").astype(bool)
+        for k, (x, y) in enumerate(data["binary_scopes"].tolist()):
+            constraint = TableConstraint(x, y, bits[binary_offsets[k]:binary_offsets[k + 1]], domains[x], domains[y])
+            constraint.value_symmetric = bool(data["binary_symmetric"][k])
+            csp.add_constraint(constraint)
+        alldiff_offsets = data["alldiff_offsets"]
+        alldiff_variables = data["alldiff_variables"].tolist()
+        for k in range(len(alldiff_offsets) - 1):
+            csp.add_constraint(AllDifferent(alldiff_variables[alldiff_offsets[k]:alldiff_offsets[k + 1]]))
+    csp.interchangeable = [[values[i] for i in group] for group in header["interchangeable"]]
+    compile_tables(csp)
+    return csp, labels
+
+
+class SolutionWriter:
+    # Appends solutions of csp to a solution file, rows are buffered and written chunk rows at a time
+    def __init__(self, path, csp: CSP, chunk=65536):
+        self.variables = csp.variables
+        values, self.index = value_list(csp)
+        self.dtype = np.dtype(np.uint8 if len(values) <= 1 << 8 else np.uint16 if len(values) <= 1 << 16
+                              else np.uint32)
+        header = json.dumps({"labels": [str(v) for v in csp.variables], "values": values,
+                             "dtype": self.dtype.str}).encode()
+        self.file = open(path, "wb")
+        self.file.write(SOLUTIONS_MAGIC + struct.pack("<Q", len(header)) + header)
+        self.file.write(b"\0" * (-self.file.tell() % 64))
+        self.buffer = np.empty((chunk, len(self.variables)), dtype=self.dtype)
+        self.filled = 0
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, solution: Dict):
+        # Only reads solution, so the live assignment of the search can be given
+        index = self.index
+        self.buffer[self.filled] = [index[solution[v]] for v in self.variables]
+        self.filled += 1
+        self.rows += 1
+        if self.filled == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.filled].tobytes())
+        self.filled = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class SolutionFile:
+    # Solution file read through a memory map: rows[i, j] is the index of the value of variable j in solution i
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            if file.read(8) != SOLUTIONS_MAGIC:
+                raise ValueError(f"{path} is not a solution file")
+            (length,) = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(length).decode())
+            file.seek(0, 2)
+            size = file.tell()
+        self.labels: List[str] = header["labels"]
+        self.values: List = header["values"]
+        dtype = np.dtype(header["dtype"])
+        offset = 16 + length
+        offset += -offset % 64
+        count = (size - offset) // (dtype.itemsize * max(1, len(self.labels)))
+        if count == 0:
+            self.rows = np.zeros((0, len(self.labels)), dtype=dtype)
+        else:
+            self.rows = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count, len(self.labels)))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def solution(self, i: int, variables: Optional[List] = None) -> Dict:
+        # Solution i as a dict, keyed by variables (of the CSP it was written for) or by labels
+        keys = self.labels if variables is None else variables
+        return {key: self.values[j] for key, j in zip(keys, self.rows[i].tolist())}
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self.rows)):
+            yield self.solution(i)
+
+    def decoded(self) -> np.ndarray:
+        # Values instead of indexes, as an object array of the same shape
+        return np.array(self.values, dtype=object)[self.rows]
+
+
+def write_solutions(path, csp: CSP, method="fc", chunk=65536, **kwargs) -> int:
+    # Streams every solution of csp to a solution file without building dicts, returns their number.
+    # kwargs are those of CSP.count_solutions, except symmetry: the sink gets one row per class of
+    # interchangeable values while the count covers all solutions, so the file would not match it.
+    if kwargs.get("symmetry"):
+        raise ValueError("write_solutions does not support symmetry, expand the solutions instead")
+    with SolutionWriter(path, csp, chunk) as writer:
+        return csp.count_solutions(method, decompose=False, sink=writer.write, **kwargs)
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+    from benchmark import grid_coloring
+
+    directory = tempfile.mkdtemp()
+    csp = grid_coloring(16, 4, seed=0)
+    instance = os.path.join(directory, "grid.npz")
+    save_instance(instance, csp)
+    loaded, labels = load_instance(instance)
+    print("Instance:", os.path.getsize(instance), "bytes", len(labels), "variables",
+          len(loaded.constraint_arcs), "constraints")
+
+    solutions = os.path.join(directory, "grid.solutions")
+    start_time = time.time()
+    count = write_solutions(solutions, loaded, "fc", ordering="mrv")
+    print("Written:", count, "solutions", round((time.time() - start_time) * 1000), "ms",
+          os.path.getsize(solutions), "bytes")
+    start_time = time.time()
+    file = SolutionFile(solutions)
+    colors = np.bincount(file.rows[:, 0], minlength=len(file.values))
+    print("Read:", len(file), "solutions", round((time.time() - start_time) * 1000), "ms",
+          "Colors of", labels[0], dict(zip(file.values, colors.tolist())))
+    print("First:", file.solution(0, csp.variables) in csp.solve("fc"))
@@ -0,0 +1,127 @@
+import numpy as np
+from typing import Dict, List, Tuple
+
+from csp import CSP, Constraint, canonical
+
+
+class ArcTable:
+    # Compiled arc (x, y): matrix[i, j] tells if x = i-th value and y = j-th value are compatible.
+    # Every row is also packed into an int bitmask over values of y, so revising x is an AND
+    # of a row with the mask of the current domain of y, and forward checking ANDs the mask with one row.
+    # Values outside of the indexes (domains given to a search can differ from csp.domains)
+    # are checked with constraint.satisfied.
+    def __init__(self, matrix: np.ndarray, x_index: Dict, y_index: Dict, constraint: Constraint, x, y):
+        self.matrix = matrix
+        self.x_index = x_index
+        self.y_index = y_index
+        self.constraint = constraint
+        self.x = x
+        self.y = y
+        packed = np.packbits(matrix, axis=1, bitorder="little")
+        self.rows: List[int] = [int.from_bytes(row.tobytes(), "little") for row in packed]
+
+    def compatible(self, xv, yv) -> bool:
+        return bool(self.constraint.satisfied({self.x: xv, self.y: yv}))
+
+    def mask(self, y_values) -> int:
+        # KeyError when a value is not in the index
+        mask = 0
+        for yv in y_values:
+            mask |= 1 << self.y_index[yv]
+        return mask
+
+    def revise(self, x_values, y_values) -> List:
+        # Values of x with at least one compatible value in y_values
+        try:
+            mask = self.mask(y_values)
+            return [xv for xv in x_values if self.rows[self.x_index[xv]] & mask]
+        except KeyError:
+            return [xv for xv, count in self.counts(x_values, y_values).items() if count != 0]
+
+    def filter(self, xv, y_values) -> List:
+        # Values of y compatible with x = xv
+        try:
+            row = self.rows[self.x_index[xv]]
+            return [yv for yv in y_values if row >> self.y_index[yv] & 1]
+        except KeyError:
+            return [yv for yv in y_values if self.supports(xv, yv)]
+
+    def supports(self, xv, yv) -> bool:
+        i = self.x_index.get(xv)
+        j = self.y_index.get(yv)
+        if i is None or j is None:
+            return self.compatible(xv, yv)
+        return bool(self.matrix[i, j])
+
+    def counts(self, x_values, y_values) -> Dict:
+        # Number of values in y_values compatible with each value in x_values
+        try:
+            mask = self.mask(y_values)
+            return {xv: bin(self.rows[self.x_index[xv]] & mask).count("1") for xv in x_values}
+        except KeyError:
+            return {xv: sum(self.supports(xv, yv) for yv in y_values) for xv in x_values}
+
+
+class TableConstraint(Constraint):
+    # Binary constraint given by its compatibility matrix over x_values and y_values,
+    # values outside of them are incompatible
+    def __init__(self, x, y, matrix, x_values: List, y_values: List):
+        super().__init__([x, y])
+        self.matrix = np.asarray(matrix, dtype=bool).reshape(len(x_values), len(y_values))
+        self.x_index = {value: i for i, value in enumerate(x_values)}
+        self.y_index = {value: i for i, value in enumerate(y_values)}
+
+    def satisfied(self, assignment: Dict) -> bool:
+        x, y = self.variables
+        if x not in assignment or y not in assignment:
+            return True
+        i = self.x_index.get(assignment[x])
+        j = self.y_index.get(assignment[y])
+        return i is not None and j is not None and bool(self.matrix[i, j])
+
+    def table(self, x_values: List, y_values: List):
+        if any(v not in self.x_index for v in x_values) or any(v not in self.y_index for v in y_values):
+            return None
+        return self.matrix[np.ix_([self.x_index[v] for v in x_values], [self.y_index[v] for v in y_values])]
+
+    def signature(self, positions: Dict):
+        return (canonical(list(self.x_index)), canonical(list(self.y_index)),
+                np.packbits(self.matrix).tobytes().hex())
+
+
+def constraint_table(constraint: Constraint, x_values: List, y_values: List) -> np.ndarray:
+    matrix = constraint.table(x_values, y_values)
+    if matrix is not None:
+        return np.asarray(matrix, dtype=bool).reshape(len(x_values), len(y_values))
+    # Fallback for constraints without their own table
+    x, y = constraint.variables
+    matrix = np.zeros((len(x_values), len(y_values)), dtype=bool)
+    for i, xv in enumerate(x_values):
+        for j, yv in enumerate(y_values):
+            matrix[i, j] = bool(constraint.satisfied({x: xv, y: yv}))
+    return matrix
+
+
+def compile_tables(csp: CSP) -> int:
+    # Tables are built for binary constraints over csp.domains and used by check_fc and ac3 afterwards.
+    # Such constraints must depend only on their two variables. Returns number of compiled constraints.
+    indexes: Dict[Tuple, Dict] = {}
+
+    def index(values):
+        key = tuple(values)
+        if key not in indexes:
+            indexes[key] = {value: i for i, value in enumerate(values)}
+        return indexes[key]
+
+    compiled = 0
+    for constraint, arcs in csp.constraint_arcs.items():
+        if len(constraint.variables) != 2:
+            continue
+        x, y = constraint.variables
+        matrix = constraint_table(constraint, csp.domains[x], csp.domains[y])
+        forward = ArcTable(matrix, index(csp.domains[x]), index(csp.domains[y]), constraint, x, y)
+        backward = ArcTable(matrix.T, index(csp.domains[y]), index(csp.domains[x]), constraint, y, x)
+        for arc in arcs:
+            arc.table = forward if arc.x == x else backward
+        compiled += 1
+    return compiled
@@ -0,0 +1,54 @@
+import operator
+
+import pytest
+
+from cache import ResultCache
+from csp import CSP, Constraint, canonical
+
+
+class Pred(Constraint[int, int]):
+    def __init__(self, x, y, fn):
+        super().__init__([x, y])
+        self.fn = fn
+
+    def satisfied(self, assignment) -> bool:
+        if self.variables[0] not in assignment or self.variables[1] not in assignment:
+            return True
+        return self.fn(assignment[self.variables[0]], assignment[self.variables[1]])
+
+
+def make(op):
+    return lambda a, b: op(a, b)
+
+
+def pred_csp(op) -> CSP:
+    csp = CSP([0, 1], {0: [1, 2, 3], 1: [1, 2, 3]})
+    csp.add_constraint(Pred(0, 1, make(op)))
+    return csp
+
+
+class Shown:
+    # repr with the address, as object.__repr__
+    def __repr__(self):
+        return f"<Shown object at {hex(id(self))}>"
+
+
+@pytest.mark.parametrize("value", [make(operator.lt), operator.ne, len, Shown().__repr__, Shown()])
+def test_canonical_refuses_values_shown_by_address(value):
+    with pytest.raises(TypeError):
+        canonical(value)
+
+
+def test_constraints_with_functions_are_not_cached():
+    # Closures freed between the two CSPs can share an address, so their repr
+    # must not make the fingerprints equal
+    cache = ResultCache()
+    counts = []
+    for op in (operator.lt, operator.ne):
+        csp = pred_csp(op)
+        csp.cache = cache
+        assert csp.cache_key("count", None, None) is None
+        counts.append(csp.count_solutions("bt"))
+        del csp
+    assert counts == [3, 6]
+    assert len(cache) == 0
@@ -0,0 +1,39 @@
+import copy
+
+from EinsteinRiddleProblem import EinsteinUniqueConstraint, Variable
+from csp import CSP
+from preprocess import preprocess
+
+
+def unique_colors() -> CSP:
+    # Every constraint has one variable in its scope, but reads the others of the category
+    variables = [Variable("color", name) for name in ("red", "green", "blue")]
+    csp = CSP(variables, {v: [1, 2, 3] for v in variables})
+    for v in variables:
+        csp.add_constraint(EinsteinUniqueConstraint(v))
+    return csp
+
+
+def test_unscoped_constraints_are_not_decomposed():
+    csp = unique_colors()
+    assert csp.components() == [csp.variables]
+    for method in ("bt", "fc"):
+        assert unique_colors().count_solutions(method) == 6
+        assert unique_colors().count_solutions(method, decompose=False) == 6
+
+
+def test_preprocess_keeps_unscoped_unary_constraints():
+    for singleton in (False, True):
+        problem, report = preprocess(unique_colors(), singleton)
+        assert report.unary == 0
+        for method in ("bt", "fc"):
+            assert len(problem.solve(method)) == 6
+
+
+def test_copies_keep_their_own_search_state():
+    csp = unique_colors()
+    csp.weights[csp.constraints[csp.variables[0]][0]] = 2
+    other = copy.copy(csp)
+    assert other.weights == csp.weights
+    for name in ("supports", "weights", "lcv_cache"):
+        assert getattr(other, name) is not getattr(csp, name)
@@ -0,0 +1,19 @@
+from benchmark import random_binary
+from decomposition import decomposed_solve, plan
+from test_csp import unique_colors
+
+
+def test_unscoped_components_are_searched():
+    csp = unique_colors()
+    assert [kind for kind, _, _ in plan(csp)] == ["search"]
+    assert len(decomposed_solve(unique_colors(), "bt")) == 6
+
+
+def test_solutions_are_counted_once():
+    for workers in (None, 2):
+        csp = random_binary(14, 3, 0.25, 0.3, seed=0)
+        solutions = decomposed_solve(csp, "fc", cutset=False, workers=workers)
+        assert csp.stats.solutions == len(solutions)
+    csp = random_binary(14, 3, 0.25, 0.3, seed=0)
+    decomposed_solve(csp, "fc", single=True)
+    assert csp.stats.solutions == 1
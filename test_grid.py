@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+import pytest
+
+from Grid import Grid, count_distance, segments_cross
+
+shapely = pytest.importorskip("shapely.geometry")
+
+
+def reference_cross(a, b, c, d) -> bool:
+    # Segments with a common end point do not cross, others do if shapely finds a common point
+    if a in (c, d) or b in (c, d):
+        return False
+    return shapely.LineString([a, b]).intersects(shapely.LineString([c, d]))
+
+
+def reference_intersect(grid: Grid, new_line) -> bool:
+    # Grid.check_intersect as it was with shapely
+    return any(reference_cross(c[0].coords(), c[1].coords(), new_line[0].coords(), new_line[1].coords())
+               for c in grid.connections)
+
+
+def reference_connections(grid: Grid):
+    # Grid.generate_connections before the spatial indexes: the nearest possible point of a random point
+    # is connected, possible points checked with shapely against all connections
+    def possible(checked):
+        return [p for p in grid.points if p != checked and not reference_intersect(grid, (p, checked))
+                and (checked, p) not in grid.connections and (p, checked) not in grid.connections]
+
+    distances = {point: sorted((p for p in grid.points if p != point), key=lambda p: count_distance(point, p))
+                 for point in grid.points}
+    while any(len(possible(point)) != 0 for point in grid.points):
+        point = random.choice(list(distances))
+        options = possible(point)
+        for dest in distances[point]:
+            if dest in options:
+                grid.connections.append((point, dest))
+                break
+
+
+def degenerate_segments(rng: random.Random, n):
+    # Small integer coordinates, so collinear, touching and overlapping segments are common.
+    # Connections join distinct points, so no segment has zero length.
+    cases = []
+    while len(cases) < n:
+        a, b, c, d = ((rng.randint(0, 4), rng.randint(0, 4)) for _ in range(4))
+        if a != b and c != d:
+            cases.append((a, b, c, d))
+    return cases
+
+
+def test_segments_cross_matches_shapely():
+    cases = degenerate_segments(random.Random(0), 20000)
+    a, b, c, d = (np.array([case[k] for case in cases], dtype=float) for k in range(4))
+    crossed = segments_cross(a, b, c, d)
+    expected = [reference_cross(*case) for case in cases]
+    assert crossed.tolist() == expected
+
+
+def test_check_intersect_matches_shapely():
+    rng = random.Random(1)
+    for _ in range(50):
+        grid = Grid(6, 6)
+        grid.random_points(12)
+        for _ in range(rng.randint(1, 8)):
+            grid.connections.append(tuple(rng.sample(grid.points, 2)))
+        for _ in range(40):
+            new_line = tuple(rng.sample(grid.points, 2))
+            assert grid.check_intersect(new_line) == reference_intersect(grid, new_line)
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_generate_connections_matches_reference(seed):
+    size, n = 5 + seed % 10, 6 + seed % 9
+    found = []
+    for generate in (Grid.generate_connections, reference_connections):
+        grid = Grid(size, size)
+        random.seed(seed)
+        grid.random_points(n)
+        generate(grid)
+        found.append([(p.coords(), q.coords()) for p, q in grid.connections])
+    assert found[0] == found[1]
+
@@ -0,0 +1,21 @@
+import pytest
+
+from benchmark import grid_coloring
+from tables import compile_tables
+
+
+def key(csp, solutions):
+    return sorted(tuple(s[v] for v in csp.variables) for s in solutions or [])
+
+
+@pytest.mark.parametrize("method", ["bt", "fc", "mac"])
+@pytest.mark.parametrize("lcv", [False, True])
+def test_domains_outside_compiled_tables(method, lcv):
+    # Tables are compiled over 3 colors, the search gets values outside of them
+    plain = grid_coloring(7, 3, 0)
+    compiled = grid_coloring(7, 3, 0)
+    compile_tables(compiled)
+    for colors in (["red", "green", "blue", "yellow"], ["yellow", "green"]):
+        domains = {v: colors for v in plain.variables}
+        expected = key(plain, plain.solve(method, domains=domains, lcv=lcv))
+        assert key(compiled, compiled.solve(method, domains=domains, lcv=lcv)) == expected